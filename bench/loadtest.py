@@ -0,0 +1,293 @@
+"""Нагрузочный прогон бота целиком, без сети.
+
+Поднимает локальную заглушку Bot API на aiohttp, направляет в неё Bot и
+прогоняет синтетических пользователей через весь сценарий бронирования
+с помощью Dispatcher.feed_update. Каждый шаг сценария выполняется всеми
+пользователями параллельно, поэтому число SQL-запросов на апдейт считается
+по каждому шагу отдельно.
+
+    python bench/loadtest.py --users 2000 --concurrency 200
+
+С --abusers N параллельно каждому шагу N пользователей засыпают бота
+сообщениями — видно, как лимиты ThrottlingMiddleware держат задержки
+обычных гостей.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import statistics
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from aiohttp import web
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "bot"))
+
+from aiogram import Bot, Dispatcher  # noqa: E402
+from aiogram.client.session.aiohttp import AiohttpSession  # noqa: E402
+from aiogram.client.telegram import TelegramAPIServer  # noqa: E402
+from aiogram.types import Update  # noqa: E402
+
+import db  # noqa: E402
+from allocation import load_inventory  # noqa: E402
+from availability import load_availability  # noqa: E402
+from bot_core import router, throttling  # noqa: E402
+from metrics import media_sends, throttled_updates  # noqa: E402
+from middlewares.throttling import TokenBucket  # noqa: E402
+from venues import default_venue  # noqa: E402
+from fsm_storage import SQLiteStorage  # noqa: E402
+from middlewares.fsm_buffer import FSMBufferMiddleware  # noqa: E402
+from outbox import Outbox  # noqa: E402
+
+
+TOKEN = "123456:loadtest"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "meteorit", "username": "meteorit_bot"}
+SQL_PREFIXES = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+ABUSE_UPDATES = 20
+
+
+class MockBotAPI:
+    """Заглушка Bot API: отвечает на любой метод правдоподобным результатом и считает вызовы."""
+
+    def __init__(self):
+        self.calls: dict[str, int] = {}
+        self._message_ids = itertools.count(1)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] = self.calls.get(method, 0) + 1
+        params = dict(await request.post())
+
+        if method == "getMe":
+            result = BOT_USER
+        elif method in ("sendMessage", "sendPhoto", "sendDocument", "editMessageText", "editMessageReplyMarkup"):
+            chat_id = int(params.get("chat_id", 0))
+            result = {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group", "title": "chat"},
+                "from": BOT_USER,
+                "text": params.get("text", ""),
+            }
+            if method == "sendPhoto":
+                # Загруженный файл приходит multipart-полем, повторная отправка — строкой file_id
+                photo = params.get("photo")
+                file_id = photo if isinstance(photo, str) else f"photo{result['message_id']}"
+                result["photo"] = [{"file_id": file_id, "file_unique_id": file_id, "width": 1280, "height": 853}]
+                result["caption"] = params.get("caption", "")
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def start(self) -> tuple[web.AppRunner, str]:
+        # Фото в Bot API — до 10 МБ, а по умолчанию aiohttp принимает тело не больше 1 МБ
+        app = web.Application(client_max_size=10 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return runner, f"http://127.0.0.1:{port}"
+
+
+class Updates:
+    """Фабрика апдейтов, сразу привязанных к Bot (без лишнего round-trip через JSON в feed_update)."""
+
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self._ids = itertools.count(1)
+
+    def _user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+
+    def _message(self, user_id: int, text: str) -> dict:
+        return {
+            "message_id": next(self._ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            "text": text,
+        }
+
+    def message(self, user_id: int, text: str) -> Update:
+        return Update.model_validate(
+            {"update_id": next(self._ids), "message": self._message(user_id, text)},
+            context={"bot": self.bot},
+        )
+
+    def callback(self, user_id: int, data: str) -> Update:
+        return Update.model_validate(
+            {
+                "update_id": next(self._ids),
+                "callback_query": {
+                    "id": str(next(self._ids)),
+                    "from": self._user(user_id),
+                    "chat_instance": str(user_id),
+                    "data": data,
+                    "message": self._message(user_id, "keyboard"),
+                },
+            },
+            context={"bot": self.bot},
+        )
+
+
+class Stats:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = {}
+        self.errors: dict[str, int] = {}
+        self.queries: dict[str, int] = {}
+        self.wall: dict[str, float] = {}
+        self._sql = 0
+
+    def trace(self, statement: str):
+        # Вызывается из потоков aiosqlite; для счётчика гонки GIL достаточно
+        if statement.lstrip().upper().startswith(SQL_PREFIXES):
+            self._sql += 1
+
+    def report(self) -> dict:
+        result = {}
+        for step, samples in self.latencies.items():
+            ordered = sorted(samples)
+
+            def pct(p: float) -> float:
+                return ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000
+
+            result[step] = {
+                "updates": len(samples),
+                "errors": self.errors.get(step, 0),
+                "throughput_rps": round(len(samples) / self.wall[step], 1) if self.wall[step] else None,
+                "p50_ms": round(statistics.median(ordered) * 1000, 2),
+                "p95_ms": round(pct(0.95), 2),
+                "p99_ms": round(pct(0.99), 2),
+                "db_queries_per_update": round(self.queries[step] / len(samples), 2),
+            }
+        return result
+
+
+async def run_step(dp: Dispatcher, bot: Bot, stats: Stats, step: str, updates, concurrency: int, noise=()):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = stats.latencies.setdefault(step, [])
+
+    async def feed(update: Update):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await dp.feed_update(bot, update)
+            except Exception:
+                stats.errors[step] = stats.errors.get(step, 0) + 1
+            latencies.append(time.perf_counter() - started)
+
+    sql_before = stats._sql
+    started = time.perf_counter()
+    # Шум от флудеров идёт мимо семафора и в задержки шага не попадает
+    await asyncio.gather(*(feed(update) for update in updates), *(dp.feed_update(bot, update) for update in noise))
+    stats.wall[step] = time.perf_counter() - started
+    stats.queries[step] = stats._sql - sql_before
+
+
+async def main(users: int, concurrency: int, abusers: int = 0) -> dict:
+    mock = MockBotAPI()
+    runner, base_url = await mock.start()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Прогон идёт в заведении по умолчанию, его база — во временном каталоге
+        await db.open_db({default_venue().id: Path(tmp) / "bookings.db"}, fsm_path=Path(tmp) / "fsm.db")
+        await db.init_db()
+        load_inventory()
+        await load_availability()
+
+        stats = Stats()
+        await db.pool.set_trace_callback(stats.trace)
+        await db.fsm_pool.set_trace_callback(stats.trace)
+
+        session = AiohttpSession(api=TelegramAPIServer.from_base(base_url))
+        bot = Bot(TOKEN, session=session)
+        storage = SQLiteStorage(ttl=3600)
+        dp = Dispatcher(storage=storage)
+        FSMBufferMiddleware(storage).setup(dp)
+        dp.include_router(router)
+        outbox = asyncio.create_task(Outbox(bot).run())
+        factory = Updates(bot)
+        # Прогон меряет пропускную способность, общий лимит срезал бы синтетический всплеск
+        throttling.global_bucket = TokenBucket(1e9, 1e9)
+        throttling.dialog_bucket = TokenBucket(1e9, 1e9)
+        abuser_ids = [1_000 + i for i in range(abusers)]
+
+        user_ids = [10_000 + i for i in range(users)]
+        # Раскидываем гостей по 14 дням и вечерним слотам, чтобы часть броней проходила, а часть упиралась в занятость
+        tomorrow = default_venue().now().date() + timedelta(days=1)
+        dates = [(tomorrow + timedelta(days=i % 13)).strftime("%d.%m.%Y") for i in range(users)]
+        times = [f"{17 + i % 5:02d}:{30 * (i // 5 % 2):02d}" for i in range(users)]
+        guests = [(3, 6, 8)[i % 3] for i in range(users)]
+
+        steps = [
+            ("send_welcome", [factory.message(u, "/start") for u in user_ids]),
+            ("start_booking", [factory.message(u, "Забронировать стол") for u in user_ids]),
+            ("choose_date", [factory.callback(u, f"date_{d}") for u, d in zip(user_ids, dates)]),
+            ("get_guests", [factory.callback(u, f"guests_{g}") for u, g in zip(user_ids, guests)]),
+            ("choose_time", [factory.callback(u, f"time_{t}") for u, t in zip(user_ids, times)]),
+            ("get_name", [factory.message(u, f"Гость {u}") for u in user_ids]),
+            ("get_phone", [factory.message(u, "+70000000000") for u in user_ids]),
+            ("my_bookings", [factory.message(u, "Мои брони") for u in user_ids]),
+        ]
+        for step, updates in steps:
+            noise = [factory.message(u, "Мои брони") for u in abuser_ids for _ in range(ABUSE_UPDATES)]
+            await run_step(dp, bot, stats, step, updates, concurrency, noise)
+
+        # Отменяем каждую вторую получившуюся бронь
+        cancels = []
+        for user_id in user_ids[::2]:
+            for booking in await db.get_booking(user_id):
+                cancels.append(factory.callback(user_id, f"cancel_{booking.id}_{default_venue().id}"))
+        if cancels:
+            await run_step(dp, bot, stats, "cancel_booking", cancels, concurrency)
+
+        report = {
+            "users": users,
+            "concurrency": concurrency,
+            "bookings": len(await db.get_all_bookings()),
+            "api_calls": mock.calls,
+            "throttled": {dict(key)["scope"]: value for key, value in throttled_updates._values.items()},
+            "media": {dict(key)["source"]: value for key, value in media_sends._values.items()},
+            "steps": stats.report(),
+        }
+
+        outbox.cancel()
+        await storage.close()
+        await bot.session.close()
+        await db.close_db()
+
+    await runner.cleanup()
+    return report
+
+
+def print_report(report: dict):
+    print(f"users={report['users']} concurrency={report['concurrency']} bookings={report['bookings']}")
+    print(f"{'step':<16}{'updates':>8}{'errors':>8}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'sql/upd':>9}")
+    for step, row in report["steps"].items():
+        print(
+            f"{step:<16}{row['updates']:>8}{row['errors']:>8}{row['throughput_rps']:>10}"
+            f"{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}{row['db_queries_per_update']:>9}"
+        )
+    print("api calls:", ", ".join(f"{k}={v}" for k, v in sorted(report["api_calls"].items())))
+    print("throttled:", ", ".join(f"{k}={v}" for k, v in sorted(report["throttled"].items())) or "-")
+    print("media:", ", ".join(f"{k}={v}" for k, v in sorted(report["media"].items())) or "-")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--abusers", type=int, default=0, help="сколько флудеров шлют сообщения параллельно шагам")
+    parser.add_argument("--json", type=Path, help="сохранить отчёт в JSON")
+    args = parser.parse_args()
+
+    result = asyncio.run(main(args.users, args.concurrency, args.abusers))
+    print_report(result)
+    if args.json:
+        args.json.write_text(json.dumps(result, ensure_ascii=False, indent=2))
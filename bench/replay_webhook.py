@@ -0,0 +1,48 @@
+"""Прогон записанных апдейтов через webhook-эндпоинт бота.
+
+Файл — JSONL, по одному апдейту Bot API в строке (в том виде, в каком его
+присылает Telegram). Апдейты отправляются POST-запросами с секретным
+заголовком, как это делает сам Telegram:
+
+    python bench/replay_webhook.py updates.jsonl --url http://127.0.0.1:8080/webhook --secret s3cret
+"""
+import argparse
+import asyncio
+import json
+import time
+from pathlib import Path
+
+from aiohttp import ClientSession
+
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+async def replay(path: Path, url: str, secret: str | None, concurrency: int) -> dict[int, int]:
+    updates = [json.loads(line) for line in path.read_text().splitlines() if line.strip()]
+    headers = {SECRET_HEADER: secret} if secret else {}
+    semaphore = asyncio.Semaphore(concurrency)
+    statuses: dict[int, int] = {}
+
+    async def post(session: ClientSession, update: dict):
+        async with semaphore:
+            async with session.post(url, json=update, headers=headers) as response:
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+
+    started = time.perf_counter()
+    async with ClientSession() as session:
+        await asyncio.gather(*(post(session, update) for update in updates))
+    elapsed = time.perf_counter() - started
+    print(f"{len(updates)} апдейтов за {elapsed:.2f} с, ответы: {statuses}")
+    return statuses
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("updates", type=Path)
+    parser.add_argument("--url", default="http://127.0.0.1:8080/webhook")
+    parser.add_argument("--secret")
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+
+    asyncio.run(replay(args.updates, args.url, args.secret, args.concurrency))
@@ -0,0 +1,282 @@
+"""Микробенчмарки и проверка свойств поиска свободного времени.
+
+Генерирует синтетические брони (от 100 до 100k строк на много дней вперёд),
+заполняет ими AvailabilityIndex и сверяет ответы быстрых движков — масок
+availability.py и подбора столов allocation.py — с эталонной реализацией,
+которая честно перебирает брони и сравнивает интервалы в местном datetime.
+Затем замеряет каждую операцию и сравнивает с сохранённым baseline:
+
+    python bench/slots.py                      # проверка + сравнение с bench/slots_baseline.json
+    python bench/slots.py --update-baseline    # записать текущие цифры как новый baseline
+
+Каждая цифра — медиана REPEATS прогонов. С baseline сравнивается не само время,
+а его отношение к калибровочному циклу, замеренному перед каждым прогоном: так
+сравнение не зависит от того, насколько загружена машина прямо сейчас. Операция,
+ставшая медленнее baseline больше чем на --tolerance, или любое расхождение с
+эталоном — код выхода 1; о любой операции медленнее baseline печатается
+предупреждение. После переезда бенчмарка на другой интерпретатор или намеренного
+изменения алгоритма baseline нужно перезаписать.
+"""
+import argparse
+import json
+import random
+import statistics
+import sys
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import NamedTuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "bot"))
+
+from db import BOOKING_DURATION  # noqa: E402
+from availability import SLOT_MINUTES, SLOTS_PER_DAY, UNIT_SEPARATOR, index, slot_of  # noqa: E402
+from allocation import inventory, load_inventory, allocate, free_starts, free_units  # noqa: E402
+from venues import default_venue  # noqa: E402
+
+
+BASELINE_PATH = Path(__file__).resolve().parent / "slots_baseline.json"
+SIZES = (100, 1_000, 10_000, 100_000)
+# Столько броней в среднем приходится на день: при 100k строк это ~3 года вперёд
+BOOKINGS_PER_DAY = 90
+FIRST_SLOT, LAST_START_SLOT = slot_of(9, 0), slot_of(22, 30)
+FIRST_DAY = date(2030, 1, 1)
+# Столы и часовой пояс — заведения по умолчанию
+TZ = default_venue().tz
+QUERIES = 2_000
+REPEATS = 9
+# Калибровочный цикл на ~2 мс: короче — шумит сам, длиннее — удлиняет прогон
+CALIBRATION_LOOPS = 20_000
+
+
+def generate(size: int, rng: random.Random) -> list[tuple[str, int, int]]:
+    """Брони (вариант рассадки, start_ts, end_ts); пересечения не исключаются — индекс их допускает."""
+    days = max(1, size // BOOKINGS_PER_DAY)
+    bookings = []
+    for _ in range(size):
+        unit = rng.choice(inventory.units)
+        day = FIRST_DAY + timedelta(days=rng.randrange(days))
+        slot = rng.randint(FIRST_SLOT, LAST_START_SLOT)
+        start = datetime.combine(day, datetime.min.time(), TZ) + timedelta(minutes=slot * SLOT_MINUTES)
+        bookings.append((unit.id, int(start.timestamp()), int((start + BOOKING_DURATION).timestamp())))
+    return bookings
+
+
+def build_index(bookings):
+    # Как и _reload в availability.py, индекс заведения берётся один раз на всю пачку
+    availability = index.current()
+    availability.clear()
+    for unit_id, start_ts, end_ts in bookings:
+        for table in unit_id.split(UNIT_SEPARATOR):
+            availability.add(table, start_ts, end_ts)
+
+
+class Reference:
+    """Эталон: для каждого слота перебирает брони стола и сравнивает интервалы напрямую."""
+
+    def __init__(self, bookings):
+        # Брони по (дню начала, столу) — только чтобы эталон не был квадратичным на 100k строк
+        self._by_day = defaultdict(list)
+        for unit_id, start_ts, end_ts in bookings:
+            start, end = datetime.fromtimestamp(start_ts, TZ), datetime.fromtimestamp(end_ts, TZ)
+            for table in unit_id.split(UNIT_SEPARATOR):
+                self._by_day[start.date(), table].append((start, end))
+
+    def is_free(self, day: date, table: str, slot: int) -> bool:
+        start = datetime.combine(day, datetime.min.time(), TZ) + timedelta(minutes=slot * SLOT_MINUTES)
+        end = start + BOOKING_DURATION
+        for near in (day - timedelta(days=1), day, day + timedelta(days=1)):
+            for booked_start, booked_end in self._by_day.get((near, table), ()):
+                if booked_start < end and start < booked_end:
+                    return False
+        return True
+
+    def unit_free(self, day: date, unit, slot: int) -> bool:
+        return all(self.is_free(day, table, slot) for table in unit.tables)
+
+    def free_starts(self, day: date, guests: int) -> set[int]:
+        return {
+            slot for slot in range(SLOTS_PER_DAY)
+            if any(self.unit_free(day, unit, slot) for unit in inventory.fitting(guests))
+        }
+
+    def allocate(self, day: date, guests: int, slot: int, last_slot: int):
+        for candidate in range(slot, last_slot + 1):
+            for unit in inventory.fitting(guests):
+                if self.unit_free(day, unit, candidate):
+                    return unit.id, candidate
+        return None, None
+
+    def free_units(self, day: date, first_slot: int, last_slot: int) -> dict[int, int]:
+        free = dict.fromkeys(inventory.seat_classes, 0)
+        for unit in inventory.units:
+            if any(self.unit_free(day, unit, slot) for slot in range(first_slot, last_slot + 1)):
+                free[unit.seats] += 1
+        return free
+
+
+def _slots(mask: int) -> set[int]:
+    return {slot for slot in range(SLOTS_PER_DAY) if mask >> slot & 1}
+
+
+def _queries(size: int, rng: random.Random, count: int) -> list[tuple[date, int, int, int]]:
+    # Дни берём и за пределами броней: пустой день — тоже важный случай
+    days = max(1, size // BOOKINGS_PER_DAY) + 2
+    queries = []
+    for _ in range(count):
+        day = FIRST_DAY + timedelta(days=rng.randrange(-1, days))
+        first = rng.randint(0, SLOTS_PER_DAY - 1)
+        queries.append((day, rng.randint(1, inventory.max_guests), first, rng.randint(first, SLOTS_PER_DAY - 1)))
+    return queries
+
+
+def check(bookings, rng: random.Random, checks: int) -> list[str]:
+    """Сравнивает движки с эталоном на случайных запросах, в том числе после снятия части броней."""
+    errors = []
+    build_index(bookings)
+    removed = set(rng.sample(range(len(bookings)), len(bookings) // 4))
+    for stage in ("после загрузки", "после снятия четверти"):
+        active = bookings
+        if removed and stage != "после загрузки":
+            # Снятие пересобирает маску из оставшихся интервалов — проверяем и этот путь
+            availability = index.current()
+            for i in removed:
+                unit_id, start_ts, end_ts = bookings[i]
+                for table in unit_id.split(UNIT_SEPARATOR):
+                    availability.remove(table, start_ts, end_ts)
+            active = [booking for i, booking in enumerate(bookings) if i not in removed]
+        reference = Reference(active)
+        for day, guests, first, last in _queries(len(bookings), rng, checks):
+            if _slots(free_starts(day, guests)) != reference.free_starts(day, guests):
+                errors.append(f"{stage}: free_starts({day}, {guests})")
+            unit, slot = allocate(day, guests, first, last)
+            if (unit.id if unit else None, slot) != reference.allocate(day, guests, first, last):
+                errors.append(f"{stage}: allocate({day}, {guests}, {first}, {last})")
+            if free_units(day, first, last) != reference.free_units(day, first, last):
+                errors.append(f"{stage}: free_units({day}, {first}, {last})")
+    return errors
+
+
+class Timing(NamedTuple):
+    value: float  # медиана, мкс или мс — как в имени метрики
+    relative: float  # медиана отношения ко времени калибровочного цикла
+
+
+def _calibrate():
+    """Эталонная работа интерпретатора: словари и целочисленная арифметика, как в движках."""
+    counts = {}
+    for i in range(CALIBRATION_LOOPS):
+        counts[i & 255] = counts.get(i & 255, 0) + (i >> 3 | i)
+
+
+def _median_time(run) -> tuple[float, float]:
+    """(медиана REPEATS прогонов run(), с; медиана их отношения к калибровке).
+
+    Скорость общей машины гуляет вдвое от секунды к секунде, а отношение к калибровочному
+    циклу, замеренному прямо перед прогоном, — в пределах ~10%: по нему и ищем регрессии.
+    """
+    # Первый прогон — прогрев кэшей и аллокатора, в замер не идёт
+    _calibrate()
+    run()
+    timings, ratios = [], []
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+        _calibrate()
+        calibrated = time.perf_counter()
+        run()
+        finished = time.perf_counter()
+        timings.append(finished - calibrated)
+        ratios.append((finished - calibrated) / (calibrated - started))
+    return statistics.median(timings), statistics.median(ratios)
+
+
+def _time_per_call(func, queries) -> Timing:
+    """Медианное время одного вызова, мкс."""
+    def run():
+        for query in queries:
+            func(*query)
+    elapsed, relative = _median_time(run)
+    return Timing(round(elapsed / len(queries) * 1e6, 3), round(relative, 4))
+
+
+def measure(size: int, bookings, rng: random.Random) -> dict[str, Timing]:
+    results = {}
+    # Сборка индекса — на всю пачку, в мс: так при старте бота читается база
+    elapsed, relative = _median_time(lambda: build_index(bookings))
+    results[f"index_build_ms/{size}"] = Timing(round(elapsed * 1e3, 3), round(relative, 4))
+
+    queries = _queries(size, rng, QUERIES)
+    tables = [unit.id for unit in inventory.units if UNIT_SEPARATOR not in unit.id]
+    results[f"index_free_starts_us/{size}"] = _time_per_call(
+        index.current().free_starts, [(day, rng.choice(tables)) for day, *_ in queries]
+    )
+    results[f"free_starts_us/{size}"] = _time_per_call(free_starts, [(day, guests) for day, guests, *_ in queries])
+    results[f"allocate_us/{size}"] = _time_per_call(allocate, queries)
+    results[f"free_units_us/{size}"] = _time_per_call(free_units, [(day, first, last) for day, _, first, last in queries])
+    return results
+
+
+def compare(results: dict[str, Timing], baseline: dict[str, dict], tolerance: float) -> tuple[list[str], list[str]]:
+    """(регрессии сверх tolerance, замедления в пределах tolerance) по времени относительно калибровки."""
+    regressions, slower = [], []
+    for name, timing in results.items():
+        expected = baseline.get(name)
+        if expected is None or timing.relative <= expected["relative"]:
+            continue
+        change = timing.relative / expected["relative"] - 1
+        line = f"{name}: {timing.value} против {expected['value']} в baseline (+{100 * change:.1f}% с поправкой на машину)"
+        (regressions if change > tolerance else slower).append(line)
+    return regressions, slower
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES))
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--checks", type=int, default=200, help="случайных запросов на сверку с эталоном")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="допустимое замедление медианы, доля от baseline")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    load_inventory()
+    results, errors = {}, []
+    for size in args.sizes:
+        rng = random.Random(args.seed + size)
+        bookings = generate(size, rng)
+        results.update(measure(size, bookings, rng))
+        errors.extend(f"{size}: {error}" for error in check(bookings, rng, args.checks))
+
+    baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+    # Записи старого формата (одно число без калибровки) сравнивать не с чем
+    baseline = {name: expected for name, expected in baseline.items() if isinstance(expected, dict)}
+    print(f"{'metric':<28}{'current':>12}{'baseline':>12}{'change':>10}")
+    for name, timing in results.items():
+        expected = baseline.get(name)
+        if expected is None:
+            print(f"{name:<28}{timing.value:>12}{'-':>12}{'-':>10}")
+            continue
+        change = f"{100 * (timing.relative / expected['relative'] - 1):+.0f}%"
+        print(f"{name:<28}{timing.value:>12}{expected['value']:>12}{change:>10}")
+
+    for error in errors:
+        print("РАСХОЖДЕНИЕ С ЭТАЛОНОМ:", error)
+    if args.update_baseline:
+        if errors:
+            print("Baseline не обновлён: движки расходятся с эталоном")
+            return 1
+        args.baseline.write_text(json.dumps({**baseline, **{name: timing._asdict() for name, timing in results.items()}}, indent=2, sort_keys=True) + "\n")
+        print(f"Baseline записан в {args.baseline}")
+        return 0
+
+    regressions, slower = compare(results, baseline, args.tolerance)
+    for warning in slower:
+        print("ПРЕДУПРЕЖДЕНИЕ: медленнее baseline:", warning)
+    for regression in regressions:
+        print("РЕГРЕССИЯ:", regression)
+    return 1 if errors or regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+import json
+from dataclasses import dataclass
+from datetime import date
+from pathlib import Path
+
+from availability import DAY_MASK, UNIT_SEPARATOR, AvailabilityIndex, index, run_mask
+from venues import VenueLocal, venue
+
+
+@dataclass(frozen=True)
+class Unit:
+    """То, что бронируется целиком: один стол или несколько сдвинутых соседних."""
+    id: str
+    tables: tuple[str, ...]
+    seats: int
+
+
+class TableInventory:
+    """Столы и допустимые сочетания столов заведения (tables.json из его настроек).
+
+    Подходящие под размер компании варианты считаются один раз при загрузке и лежат
+    в порядке best-fit: сначала меньше мест, при равенстве — меньше сдвинутых столов.
+    """
+
+    def __init__(self):
+        self.units: list[Unit] = []
+        self.max_guests = 0
+        self._fitting: dict[int, list[Unit]] = {}
+        self._conflicts: dict[str, list[str]] = {}
+
+    def load(self, path: Path | str):
+        raw = json.loads(Path(path).read_text(encoding="utf-8"))
+
+        seats = {}
+        for table in raw["tables"]:
+            if table["id"] in seats or UNIT_SEPARATOR in table["id"]:
+                raise ValueError(f"Некорректный id стола: {table['id']}")
+            seats[table["id"]] = int(table["seats"])
+
+        units = [Unit(table_id, (table_id,), count) for table_id, count in seats.items()]
+        for combination in raw.get("combinations", []):
+            tables = tuple(combination["tables"])
+            unknown = [t for t in tables if t not in seats]
+            if unknown or len(set(tables)) != len(tables) or len(tables) < 2:
+                raise ValueError(f"Некорректное сочетание столов: {tables}")
+            count = int(combination.get("seats", sum(seats[t] for t in tables)))
+            units.append(Unit(UNIT_SEPARATOR.join(tables), tables, count))
+
+        units.sort(key=lambda unit: (unit.seats, len(unit.tables), unit.id))
+        self.units = units
+        self.max_guests = max(unit.seats for unit in units)
+        self._fitting = {
+            guests: [unit for unit in units if unit.seats >= guests]
+            for guests in range(1, self.max_guests + 1)
+        }
+        # Бронь одного варианта исключает все варианты, которые делят с ним хотя бы один стол
+        self._conflicts = {
+            unit.id: [other.id for other in units if set(unit.tables) & set(other.tables)]
+            for unit in units
+        }
+
+    @property
+    def seat_classes(self) -> list[int]:
+        return sorted({unit.seats for unit in self.units})
+
+    def fitting(self, guests: int) -> list[Unit]:
+        return self._fitting.get(guests, [])
+
+    def conflicts(self, unit_id: str) -> list[str]:
+        return self._conflicts.get(unit_id, [unit_id])
+
+
+inventory = VenueLocal(TableInventory)
+
+
+def load_inventory(path: Path | str | None = None):
+    """Загружает столы текущего заведения; path подменяет файл из его настроек."""
+    inventory.load(path or venue().tables_path)
+
+
+def unit_starts(day: date, unit: Unit, availability: AvailabilityIndex) -> int:
+    """Маска слотов, с которых свободны все столы варианта."""
+    starts = DAY_MASK
+    for table in unit.tables:
+        starts &= availability.free_starts(day, table)
+    return starts
+
+
+def free_starts(day: date, guests: int) -> int:
+    """Маска слотов, с которых компанию из `guests` человек можно куда-то посадить."""
+    # Индекс и столы заведения берём один раз, а не через прокси на каждый вариант
+    availability = index.current()
+    mask = 0
+    for unit in inventory.fitting(guests):
+        mask |= unit_starts(day, unit, availability)
+    return mask
+
+
+def allocate(day: date, guests: int, slot: int, last_slot: int, exclude=()) -> tuple[Unit | None, int | None]:
+    """Самый маленький подходящий вариант, свободный в `slot`, иначе — ближайшее более позднее время.
+
+    Возвращает (вариант, слот); если в [slot, last_slot] мест нет — (None, None).
+    """
+    window = run_mask(last_slot + 1) >> slot << slot
+    availability = index.current()
+    best_unit, best_slot = None, None
+    for unit in inventory.fitting(guests):
+        if unit.id in exclude:
+            continue
+        starts = unit_starts(day, unit, availability) & window
+        if not starts:
+            continue
+        free_slot = (starts & -starts).bit_length() - 1
+        if free_slot == slot:
+            return unit, slot
+        if best_slot is None or free_slot < best_slot:
+            best_unit, best_slot = unit, free_slot
+    return best_unit, best_slot
+
+
+def free_units(day: date, first_slot: int, last_slot: int) -> dict[int, int]:
+    """Сколько вариантов каждой вместимости свободны хотя бы с одного слота в [first_slot, last_slot]."""
+    window = run_mask(last_slot + 1) >> first_slot << first_slot
+    tables, availability = inventory.current(), index.current()
+    free = dict.fromkeys(tables.seat_classes, 0)
+    if first_slot > last_slot:
+        return free
+    for unit in tables.units:
+        if unit_starts(day, unit, availability) & window:
+            free[unit.seats] += 1
+    return free
@@ -0,0 +1,218 @@
+import asyncio
+import logging
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta, tzinfo
+from typing import Callable
+
+from db import BOOKING_DURATION, BookingRecord, get_active_bookings, subscribe
+from venues import VenueLocal, venue
+
+
+SLOT_MINUTES = 30
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+DAY_MASK = (1 << SLOTS_PER_DAY) - 1
+BOOKING_SLOTS = int(BOOKING_DURATION.total_seconds()) // (SLOT_MINUTES * 60)
+# Бронь сдвинутых столов хранится одной строкой: "T3_1+T3_2"
+UNIT_SEPARATOR = "+"
+
+
+def slot_of(hour: int, minute: int) -> int:
+    return (hour * 60 + minute) // SLOT_MINUTES
+
+
+def slot_label(slot: int) -> str:
+    minutes = slot * SLOT_MINUTES
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def _to_slot(ts: int, tz: tzinfo) -> tuple[date, int]:
+    dt = datetime.fromtimestamp(ts, tz)
+    return dt.date(), slot_of(dt.hour, dt.minute)
+
+
+def run_mask(length: int) -> int:
+    return (1 << length) - 1
+
+
+class AvailabilityIndex:
+    """Занятость столов по дням (местное время заведения): на каждую пару (дата, стол) — 48-битная маска получасов."""
+
+    def __init__(self, tz: tzinfo | None = None):
+        # Пояс заведения фиксируется при создании, чтобы не искать его на каждую бронь
+        self.tz = tz or venue().tz
+        self._masks: dict[tuple[date, str], int] = {}
+        # Сами интервалы нужны, чтобы корректно снимать бронь, если брони пересекаются
+        self._intervals: dict[tuple[date, str], Counter] = defaultdict(Counter)
+        # Версия дня растёт при каждом изменении его занятости — по ней инвалидируются кэши
+        self._versions: dict[date, int] = defaultdict(int)
+        self._generation = 0
+
+    def clear(self):
+        self._masks.clear()
+        self._intervals.clear()
+        self._versions.clear()
+        self._generation += 1
+
+    def version(self, day: date) -> tuple[int, int]:
+        return self._generation, self._versions.get(day, 0)
+
+    def _touch(self, day: date):
+        # Занятость после полуночи влияет и на поздние слоты предыдущего дня
+        self._versions[day] += 1
+        self._versions[day - timedelta(days=1)] += 1
+
+    def _spans(self, start_ts: int, end_ts: int):
+        # Бронь может переходить через полночь — режем её по дням
+        day, slot = _to_slot(start_ts, self.tz)
+        length = -(-(end_ts - start_ts) // (SLOT_MINUTES * 60))
+        while length > 0:
+            take = min(length, SLOTS_PER_DAY - slot)
+            yield day, slot, take
+            length -= take
+            day, slot = day + timedelta(days=1), 0
+
+    def _rebuild(self, key: tuple[date, str]):
+        mask = 0
+        for start, length in self._intervals[key]:
+            mask |= run_mask(length) << start
+        if mask:
+            self._masks[key] = mask
+        else:
+            self._masks.pop(key, None)
+            self._intervals.pop(key, None)
+
+    def add(self, table: str, start_ts: int, end_ts: int):
+        for day, slot, length in self._spans(start_ts, end_ts):
+            key = (day, table)
+            self._touch(day)
+            self._intervals[key][(slot, length)] += 1
+            self._masks[key] = self._masks.get(key, 0) | (run_mask(length) << slot)
+
+    def remove(self, table: str, start_ts: int, end_ts: int):
+        for day, slot, length in self._spans(start_ts, end_ts):
+            key = (day, table)
+            intervals = self._intervals.get(key)
+            if not intervals or not intervals[(slot, length)]:
+                continue
+            intervals[(slot, length)] -= 1
+            if not intervals[(slot, length)]:
+                del intervals[(slot, length)]
+            self._rebuild(key)
+            self._touch(day)
+
+    def snapshot(self) -> dict[tuple[date, str], int]:
+        return dict(self._masks)
+
+    def freed_since(self, snapshot: dict[tuple[date, str], int]) -> dict[date, int]:
+        """Слоты по дням, которые были заняты в `snapshot` хотя бы у одного стола, а теперь свободны."""
+        freed = defaultdict(int)
+        for (day, table), mask in snapshot.items():
+            gone = mask & ~self._masks.get((day, table), 0)
+            if gone:
+                freed[day] |= gone
+        return dict(freed)
+
+    def mask(self, day: date, table: str) -> int:
+        return self._masks.get((day, table), 0)
+
+    def free_starts(self, day: date, table: str, length: int = BOOKING_SLOTS) -> int:
+        """Маска слотов дня, с которых стол свободен `length` получасов подряд."""
+        occupied = self.mask(day, table) | (self.mask(day + timedelta(days=1), table) << SLOTS_PER_DAY)
+        free = ~occupied
+        starts = free
+        for shift in range(1, length):
+            starts &= free >> shift
+        return starts & DAY_MASK
+
+    def is_free(self, day: date, table: str, slot: int, length: int = BOOKING_SLOTS) -> bool:
+        return bool(self.free_starts(day, table, length) >> slot & 1)
+
+    def next_free(self, day: date, table: str, slot: int, last_slot: int, length: int = BOOKING_SLOTS) -> int | None:
+        """Первый слот в [slot, last_slot], с которого стол свободен."""
+        starts = self.free_starts(day, table, length) >> slot << slot
+        starts &= run_mask(last_slot + 1)
+        if not starts:
+            return None
+        return (starts & -starts).bit_length() - 1
+
+
+# У каждого заведения свой индекс
+index = VenueLocal(AvailabilityIndex)
+# Сколько изменений пришло из этого процесса, по заведениям: по нему видно, что снимок из базы мог устареть
+_local_changes: dict[str, int] = defaultdict(int)
+_reload_tasks: dict[str, asyncio.Task] = {}
+# Слушатели слотов, освободившихся по данным другого экземпляра: (дата, маска слотов)
+_freed_listeners: dict[str, list[Callable[[date, int], None]]] = defaultdict(list)
+
+
+def subscribe_freed(listener: Callable[[date, int], None]):
+    """Другой экземпляр не сообщает, какую бронь снял, — об этом говорит сравнение индекса до и после перечитывания."""
+    listeners = _freed_listeners[venue().id]
+    if listener not in listeners:
+        listeners.append(listener)
+
+
+def unsubscribe_freed(listener: Callable[[date, int], None]):
+    listeners = _freed_listeners[venue().id]
+    if listener in listeners:
+        listeners.remove(listener)
+
+
+def _add(booking: BookingRecord, availability: AvailabilityIndex):
+    for table in booking.table_number.split(UNIT_SEPARATOR):
+        availability.add(table, booking.start_ts, booking.end_ts)
+
+
+def _on_saved(booking: BookingRecord):
+    _local_changes[venue().id] += 1
+    _add(booking, index.current())
+
+
+def _on_removed(booking: BookingRecord):
+    _local_changes[venue().id] += 1
+    availability = index.current()
+    for table in booking.table_number.split(UNIT_SEPARATOR):
+        availability.remove(table, booking.start_ts, booking.end_ts)
+
+
+async def _reload():
+    while True:
+        seen = _local_changes[venue().id]
+        bookings = await get_active_bookings()
+        if seen == _local_changes[venue().id]:
+            break
+    # Пересборка синхронная: между очисткой и заполнением никто не увидит пустой индекс
+    availability = index.current()
+    before = availability.snapshot()
+    availability.clear()
+    for booking in bookings:
+        _add(booking, availability)
+
+    for day, mask in availability.freed_since(before).items():
+        for listener in _freed_listeners[venue().id]:
+            try:
+                listener(day, mask)
+            except Exception:
+                logging.exception("Ошибка в обработчике освободившихся слотов")
+
+
+async def _reload_logged():
+    try:
+        await _reload()
+    except Exception:
+        logging.exception("Ошибка при перечитывании занятости столов")
+
+
+def _on_external(area: str):
+    # Бронь сделали или отменили на другом экземпляре бота; задача унаследует контекст заведения
+    task = _reload_tasks.get(venue().id)
+    if area == "bookings" and (task is None or task.done()):
+        _reload_tasks[venue().id] = asyncio.create_task(_reload_logged())
+
+
+async def load_availability():
+    """Загружает индекс текущего заведения и подписывает его на события этого заведения."""
+    subscribe("saved", _on_saved)
+    subscribe("removed", _on_removed)
+    subscribe("external", _on_external)
+    await _reload()
@@ -1,8 +1,27 @@
 from aiogram import Router
 
+from middlewares.idempotency import IdempotencyMiddleware
+from middlewares.metrics import HandlerNameMiddleware, MetricsMiddleware
+from middlewares.throttling import ThrottlingMiddleware
+from middlewares.venue import VenueMiddleware
+
 router = Router()
+# Один экземпляр на оба типа апдейтов: у пользователя и у бота в целом по одному ведру
+throttling = ThrottlingMiddleware()
+
+for event_type in ("message", "callback_query"):
+    observer = router.observers[event_type]
+    # Отброшенные лимитом апдейты не доходят даже до метрик хендлеров
+    observer.outer_middleware(throttling)
+    # Метрики и хендлеры уже видят заведение апдейта
+    observer.outer_middleware(VenueMiddleware())
+    observer.outer_middleware(MetricsMiddleware(event_type))
+    observer.middleware(HandlerNameMiddleware())
+
+router.callback_query.middleware(IdempotencyMiddleware())
 
 
-from handlers import form
+from handlers import form, manager
 
-router.include_router(form.router)
\ No newline at end of file
+router.include_router(form.router)
+router.include_router(manager.router)
@@ -1,9 +1,48 @@
-from pydantic import SecretStr
+import re
+from pathlib import Path
+from typing import Literal
+
+from pydantic import SecretStr, model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
     bot_token: SecretStr
 
+    # polling — long polling, webhook — aiohttp-сервер, на который Telegram присылает апдейты
+    mode: Literal["polling", "webhook"] = "polling"
+    # Публичный адрес бота; если пустой, webhook в Telegram не регистрируется (удобно для локальных прогонов)
+    webhook_url: str = ""
+    webhook_path: str = "/webhook"
+    # Обязателен в режиме webhook: без него апдейты мог бы подделать любой, кто знает адрес
+    webhook_secret: SecretStr | None = None
+    webhook_host: str = "0.0.0.0"
+    webhook_port: int = 8080
+    # Сколько апдейтов обрабатывается одновременно
+    webhook_workers: int = 32
+
+    # Prometheus-метрики на локальном HTTP-порту; 0 — выключено
+    metrics_host: str = "127.0.0.1"
+    metrics_port: int = 9100
+
+    # Через сколько часов без активности брошенный диалог бронирования забывается
+    fsm_ttl_hours: float = 48
+    # Файл базы диалогов, общий для всех заведений
+    fsm_db_path: Path = Path(__file__).parent / "fsm.db"
+
+    # Заведения: столы, часы работы, чат менеджеров и файл базы каждого, см. bot/venues.json
+    venues_path: Path = Path(__file__).parent / "venues.json"
+
+    @model_validator(mode="after")
+    def check_webhook_secret(self):
+        if self.mode != "webhook":
+            return self
+        if self.webhook_secret is None:
+            raise ValueError("В режиме webhook нужен webhook_secret")
+        # Ограничения Telegram на secret_token в setWebhook
+        if not re.fullmatch(r"[A-Za-z0-9_-]{1,256}", self.webhook_secret.get_secret_value()):
+            raise ValueError("webhook_secret: 1–256 символов A-Z, a-z, 0-9, _ и -")
+        return self
+
     model_config = SettingsConfigDict(
         env_file=".env",
         env_file_encoding="utf-8"
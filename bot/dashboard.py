@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramRetryAfter
+
+from db import (
+    BookingRecord, subscribe, unsubscribe,
+    get_day_schedule, get_dashboard_messages, save_dashboard_message, delete_dashboard_message,
+)
+from venues import venue
+
+
+# Не чаще раза в DEBOUNCE_SECONDS перерисовываем расписание — правки копятся в пачку
+DEBOUNCE_SECONDS = 5
+HORIZON_DAYS = 14
+# Отдельное уведомление менеджерам — только если до начала брони меньше этого
+ALERT_WITHIN = timedelta(hours=3)
+MESSAGE_LIMIT = 4096
+WEEKDAYS = ("пн", "вт", "ср", "чт", "пт", "сб", "вс")
+
+
+def starts_soon(booking: BookingRecord) -> bool:
+    return booking.start_ts - time.time() < ALERT_WITHIN.total_seconds()
+
+
+def _day_of(booking: BookingRecord) -> date:
+    return datetime.fromtimestamp(booking.start_ts, venue().tz).date()
+
+
+def render_day(day: date, bookings: list[BookingRecord]) -> str:
+    lines = [
+        f"📋 Брони на {day.strftime('%d.%m.%Y')} ({WEEKDAYS[day.weekday()]}): {len(bookings)}",
+        f"🕒 Обновлено в {venue().now().strftime('%H:%M')}",
+    ]
+    by_table = defaultdict(list)
+    for booking in bookings:
+        by_table[booking.table_number].append(booking)
+    for table in sorted(by_table):
+        lines.append(f"\n🪑 {table}")
+        for booking in by_table[table]:
+            lines.append(f"  {booking.time} · {booking.guests} чел. · {booking.name} {booking.phone}".rstrip())
+    text = "\n".join(lines)
+    if len(text) > MESSAGE_LIMIT:
+        text = text[:MESSAGE_LIMIT - 1] + "…"
+    return text
+
+
+class Dashboard:
+    """Закреплённое расписание дня в чате менеджеров вместо сообщения на каждую бронь.
+
+    Изменения броней помечают день «грязным»; раз в DEBOUNCE_SECONDS все грязные дни
+    перерисовываются и правятся на месте. Id сообщений лежат в БД, чтобы после
+    перезапуска или смены лидера правилось то же сообщение.
+    """
+
+    def __init__(self, bot: Bot, chat_id: int, debounce: float = DEBOUNCE_SECONDS):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.debounce = debounce
+        self._dirty: set[date] = set()
+        self._wakeup = asyncio.Event()
+        self._messages: dict[date, int] = {}
+        self._rendered: dict[date, str] = {}
+
+    def _mark(self, booking: BookingRecord):
+        self._dirty.add(_day_of(booking))
+        self._wakeup.set()
+
+    def _mark_horizon(self, area: str = "bookings"):
+        # Другой экземпляр не говорит, какой день он поменял, — сверяем весь горизонт;
+        # неизменившиеся дни отсеются сравнением текста и правок не вызовут
+        if area == "bookings":
+            today = venue().now().date()
+            self._dirty.update(today + timedelta(days=i) for i in range(HORIZON_DAYS))
+            self._wakeup.set()
+
+    async def _publish(self, day: date, text: str):
+        message_id = self._messages.get(day)
+        if message_id is not None:
+            try:
+                await self.bot.edit_message_text(text, chat_id=self.chat_id, message_id=message_id)
+                return
+            except TelegramBadRequest as e:
+                if "message is not modified" in str(e):
+                    return
+                # Сообщение удалили руками — пришлём новое
+                logging.warning("Не удалось обновить расписание на %s: %s", day, e)
+
+        message = await self.bot.send_message(self.chat_id, text, disable_notification=True)
+        self._messages[day] = message.message_id
+        await save_dashboard_message(day.isoformat(), self.chat_id, message.message_id)
+        try:
+            await self.bot.pin_chat_message(self.chat_id, message.message_id, disable_notification=True)
+        except TelegramAPIError as e:
+            logging.warning("Не удалось закрепить расписание на %s: %s", day, e)
+
+    async def _unpin_past(self, today: date):
+        for day in [d for d in self._messages if d < today]:
+            message_id = self._messages.pop(day)
+            self._rendered.pop(day, None)
+            try:
+                await self.bot.unpin_chat_message(self.chat_id, message_id=message_id)
+            except TelegramAPIError as e:
+                logging.warning("Не удалось открепить расписание на %s: %s", day, e)
+            await delete_dashboard_message(day.isoformat())
+
+    async def flush(self):
+        today = venue().now().date()
+        await self._unpin_past(today)
+        dirty, self._dirty = self._dirty, set()
+        for day in sorted(d for d in dirty if d >= today):
+            start = datetime.combine(day, datetime.min.time(), venue().tz)
+            bookings = await get_day_schedule(int(start.timestamp()), int((start + timedelta(days=1)).timestamp()))
+            # Пустой день без сообщения не публикуем
+            if not bookings and day not in self._messages:
+                continue
+            text = render_day(day, bookings)
+            # Строка «Обновлено в» не в счёт: правим, только если поменялись сами брони
+            if self._rendered.get(day, "").split("\n", 2)[::2] == text.split("\n", 2)[::2]:
+                continue
+            try:
+                await self._publish(day, text)
+            except TelegramRetryAfter as e:
+                self._dirty.add(day)
+                await asyncio.sleep(e.retry_after)
+                continue
+            except Exception:
+                logging.exception("Ошибка при обновлении расписания на %s", day)
+                self._dirty.add(day)
+                continue
+            self._rendered[day] = text
+
+    async def run(self):
+        self._messages = {
+            date.fromisoformat(day): message_id
+            for day, message_id in (await get_dashboard_messages(self.chat_id)).items()
+        }
+        subscribe("saved", self._mark)
+        subscribe("removed", self._mark)
+        subscribe("external", self._mark_horizon)
+        self._mark_horizon()
+        try:
+            while True:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                try:
+                    await self.flush()
+                except Exception:
+                    logging.exception("Ошибка при обновлении расписания для менеджеров")
+                await asyncio.sleep(self.debounce)
+                if self._dirty:
+                    self._wakeup.set()
+        finally:
+            unsubscribe("saved", self._mark)
+            unsubscribe("removed", self._mark)
+            unsubscribe("external", self._mark_horizon)
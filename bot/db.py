@@ -1,162 +1,950 @@
 import aiosqlite
 import logging
+from collections import defaultdict
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta, timezone
-from aiogram import Bot
+from pathlib import Path
+from typing import Callable, NamedTuple
 import asyncio
+import time
+from migrations import FSM_MIGRATIONS, migrate
+from metrics import timed
+from venues import venue, all_venues, use_venue
+
+
+BOOKING_DURATION = timedelta(hours=2)
+
+HOLD_TTL = timedelta(minutes=10)
+
+READERS_COUNT = 4
+# Диалоги всех заведений — в своём файле, их запись не ждёт записи броней
+FSM_DB_PATH = Path(__file__).parent / "fsm.db"
+STATEMENT_CACHE_SIZE = 256
+
+BOOKING_COLUMNS = "id, user_id, table_number, guests, time, name, start_ts, end_ts, phone"
+
+
+class BookingRecord(NamedTuple):
+    id: int
+    user_id: int
+    table_number: str
+    guests: int
+    time: str
+    name: str
+    start_ts: int
+    end_ts: int
+    phone: str = ""
+
+
+class WaitlistEntry(NamedTuple):
+    id: int
+    user_id: int
+    day: str  # ISO-дата в МСК
+    first_slot: int
+    last_slot: int
+    guests: int
+    name: str
+    phone: str
+    offer_table: str | None = None
+    offer_start_ts: int | None = None
+    offer_expires_at: int | None = None
+
+
+WAITLIST_COLUMNS = (
+    "id, user_id, day, first_slot, last_slot, guests, name, phone, offer_table, offer_start_ts, offer_expires_at"
+)
+
+
+# (chat_id, text) или (chat_id, text, reply_markup в JSON) для очереди исходящих сообщений
+OutboxMessage = tuple[int, str] | tuple[int, str, str]
+ComposeMessages = Callable[[list[BookingRecord]], list[OutboxMessage]]
+# (имя аренды, fencing token): запись фоновой задачи пройдёт, только если аренда всё ещё наша
+Fence = tuple[str, int]
+
+
+class LeaseLostError(Exception):
+    """Аренда лидерства перешла к другому экземпляру, запись отменена."""
+
+# journal_mode=WAL сохраняется в самом файле, остальное выставляется на каждое соединение
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -8000",
+    "PRAGMA mmap_size = 67108864",
+)
+
+
+class ConnectionPool:
+    """Одно соединение-писатель и пул читателей, открытые на всё время работы бота."""
+
+    def __init__(self, path: str, readers: int = READERS_COUNT):
+        self.path = path
+        self.readers_count = readers
+        self._writer: aiosqlite.Connection | None = None
+        self._write_lock = asyncio.Lock()
+        self._readers: asyncio.Queue[aiosqlite.Connection] = asyncio.Queue()
+        self._all_readers: list[aiosqlite.Connection] = []
+        self._after_commit: list[Callable[[], None]] = []
+
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None
+
+    async def _connect(self, read_only: bool = False) -> aiosqlite.Connection:
+        # isolation_level=None: транзакциями управляем сами в writer()
+        conn = await aiosqlite.connect(
+            self.path, isolation_level=None, cached_statements=STATEMENT_CACHE_SIZE
+        )
+        for pragma in PRAGMAS:
+            await conn.execute(pragma)
+        if read_only:
+            await conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    async def open(self):
+        if self.is_open:
+            return
+        self._writer = await self._connect()
+        for _ in range(self.readers_count):
+            conn = await self._connect(read_only=True)
+            self._all_readers.append(conn)
+            self._readers.put_nowait(conn)
+
+    async def set_trace_callback(self, callback):
+        # Для бенчмарков и отладки: callback получает текст каждого выполненного SQL
+        for conn in [self._writer, *self._all_readers]:
+            await conn.set_trace_callback(callback)
+
+    async def close(self):
+        if not self.is_open:
+            return
+        async with self._write_lock:
+            for conn in self._all_readers:
+                await conn.close()
+            self._all_readers.clear()
+            self._readers = asyncio.Queue()
+            await self._writer.execute("PRAGMA optimize")
+            await self._writer.close()
+            self._writer = None
+
+    @asynccontextmanager
+    async def reader(self):
+        if not self.is_open:
+            raise RuntimeError("Пул соединений не открыт, вызовите open_db()")
+        conn = await self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put_nowait(conn)
+
+    def after_commit(self, callback: Callable[[], None]):
+        """Вызывает callback после commit текущей транзакции писателя; при rollback он отбрасывается."""
+        self._after_commit.append(callback)
+
+    @asynccontextmanager
+    async def writer(self):
+        """Соединение-писатель внутри транзакции: commit при успехе, rollback при ошибке."""
+        if not self.is_open:
+            raise RuntimeError("Пул соединений не открыт, вызовите open_db()")
+        async with self._write_lock:
+            # IMMEDIATE сразу берёт блокировку записи: проверка и вставка не разойдутся
+            # даже между процессами, работающими с одним файлом
+            await self._writer.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._writer
+            except BaseException:
+                self._after_commit.clear()
+                await self._writer.rollback()
+                raise
+            else:
+                await self._writer.commit()
+                callbacks, self._after_commit = self._after_commit, []
+                for callback in callbacks:
+                    callback()
+
+
+class ShardRouter:
+    """Шардирование по заведениям: у каждого свой файл базы и свой ConnectionPool.
+
+    reader() и writer() отдают соединение из пула заведения текущей задачи (venues.use_venue),
+    поэтому функции ниже не знают о шардах. Писатели разных заведений не ждут друг друга.
+    """
+
+    def __init__(self):
+        self.shards: dict[str, ConnectionPool] = {}
+
+    @property
+    def is_open(self) -> bool:
+        return bool(self.shards) and all(shard.is_open for shard in self.shards.values())
+
+    @property
+    def current(self) -> ConnectionPool:
+        shard = self.shards.get(venue().id)
+        if shard is None:
+            raise RuntimeError(f"Нет базы заведения {venue().id}, вызовите open_db()")
+        return shard
+
+    def add(self, venue_id: str, path: str):
+        if venue_id not in self.shards:
+            self.shards[venue_id] = ConnectionPool(path)
+
+    async def open(self):
+        for shard in self.shards.values():
+            await shard.open()
+
+    async def close(self):
+        for shard in self.shards.values():
+            await shard.close()
+        self.shards.clear()
+
+    async def set_trace_callback(self, callback):
+        for shard in self.shards.values():
+            await shard.set_trace_callback(callback)
+
+    def reader(self):
+        return self.current.reader()
+
+    def writer(self):
+        return self.current.writer()
+
+    def after_commit(self, callback: Callable[[], None]):
+        self.current.after_commit(callback)
+
+
+pool = ShardRouter()
+# Диалоги (FSM) общие для всех заведений: в диалоге и хранится выбранное заведение
+fsm_pool = ConnectionPool(str(FSM_DB_PATH))
+
+
+async def open_db(paths: dict[str, str | Path] | None = None, fsm_path: str | Path = FSM_DB_PATH):
+    """Открывает базы всех заведений и базу диалогов; paths подменяет файлы отдельных заведений (бенчмарки, отладка)."""
+    for item in all_venues():
+        pool.add(item.id, str((paths or {}).get(item.id, item.db_path)))
+    await pool.open()
+    if not fsm_pool.is_open:
+        fsm_pool.path = str(fsm_path)
+        await fsm_pool.open()
+
+
+async def close_db():
+    await pool.close()
+    await fsm_pool.close()
 
 
-DB_PATH = "bot/bookings.db"
-MSK = timezone(timedelta(hours=3))
-
 async def init_db():
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS bookings (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                table_number TEXT NOT NULL,
-                time TEXT NOT NULL,
-                name TEXT NOT NULL,
-                booking_at TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-            """)
-        await db.commit()
+    for item in all_venues():
+        with use_venue(item.id):
+            async with pool.writer() as db:
+                await migrate(db)
+    async with fsm_pool.writer() as db:
+        await migrate(db, FSM_MIGRATIONS)
 
 
-async def migrate_add_notification_flags():
-    async with aiosqlite.connect(DB_PATH) as db:
-        try:
-            await db.execute("ALTER TABLE bookings ADD COLUMN notify_24_sent BOOLEAN DEFAULT 0")
-        except aiosqlite.OperationalError:
-            pass  # колонка уже есть
+# Подписчики на изменения ("saved" / "removed" — брони, "enqueued" — сообщения в outbox,
+# "waitlisted" / "unwaitlisted" — заявки листа ожидания), вызываются после commit.
+# "external" — другой экземпляр бота изменил область данных ("bookings", "outbox"
+# или "waitlist"), о таких изменениях узнаём из watch_versions().
+# Подписки раздельные по заведениям: слушатель получает события того заведения,
+# в контексте которого подписался
+EVENTS = ("saved", "removed", "enqueued", "waitlisted", "unwaitlisted", "external")
+_listeners: dict[str, dict[str, list[Callable]]] = defaultdict(lambda: {event: [] for event in EVENTS})
+
+
+def subscribe(event: str, listener: Callable):
+    listeners = _listeners[venue().id][event]
+    if listener not in listeners:
+        listeners.append(listener)
+
+
+def unsubscribe(event: str, listener: Callable):
+    listeners = _listeners[venue().id][event]
+    if listener in listeners:
+        listeners.remove(listener)
+
+
+def _notify(event: str, items):
+    listeners = _listeners[venue().id][event]
+    for item in items:
+        for listener in listeners:
+            try:
+                listener(item)
+            except Exception:
+                logging.exception("Ошибка в обработчике события %s", event)
+
+
+# Последние известные этому экземпляру значения sync_versions, по заведениям
+_known_versions: dict[str, dict[str, int]] = defaultdict(dict)
+SYNC_INTERVAL = 1.0
 
+
+async def _bump_version(db: aiosqlite.Connection, name: str):
+    cursor = await db.execute("UPDATE sync_versions SET seq = seq + 1 WHERE name = ? RETURNING seq", (name,))
+    (seq,) = await cursor.fetchone()
+    known = _known_versions[venue().id]
+
+    def seen():
+        # Если между нашими записями вклинился другой экземпляр, счётчик убежит больше чем на 1 —
+        # тогда оставляем старое значение, и watch_versions() сообщит об изменении
+        if known.get(name) == seq - 1:
+            known[name] = seq
+
+    pool.after_commit(seen)
+
+
+@timed
+async def get_versions() -> dict[str, int]:
+    async with pool.reader() as db:
+        return dict(await db.execute_fetchall("SELECT name, seq FROM sync_versions"))
+
+
+async def watch_versions(interval: float = SYNC_INTERVAL):
+    """Раз в `interval` секунд сверяет sync_versions и шлёт "external" по областям, которые изменил кто-то другой.
+
+    Следит за базой текущего заведения: на каждое заведение запускается своя задача.
+    """
+    known = _known_versions[venue().id]
+    known.update(await get_versions())
+    while True:
+        await asyncio.sleep(interval)
         try:
-            await db.execute("ALTER TABLE bookings ADD COLUMN notify_12_sent BOOLEAN DEFAULT 0")
-        except aiosqlite.OperationalError:
-            pass  # колонка уже есть
+            versions = await get_versions()
+        except Exception:
+            logging.exception("Ошибка при чтении sync_versions")
+            continue
+        changed = [name for name, seq in versions.items() if seq != known.get(name)]
+        known.update(versions)
+        _notify("external", changed)
+
+
+@timed
+async def acquire_lease(name: str, owner: str, ttl: float) -> int | None:
+    """Берёт или продлевает аренду. Возвращает fencing token или None, если аренда у другого и не истекла."""
+    now = time.time()
+    async with pool.writer() as db:
+        await db.execute(
+            "INSERT OR IGNORE INTO leader_lease (name, owner, token, expires_at) VALUES (?, '', 0, 0)",
+            (name,)
+        )
+        cursor = await db.execute(
+            """
+            UPDATE leader_lease
+            SET token = CASE WHEN owner = ? THEN token ELSE token + 1 END, owner = ?, expires_at = ?
+            WHERE name = ? AND (owner = ? OR expires_at <= ?)
+            RETURNING token
+            """,
+            (owner, owner, now + ttl, name, owner, now)
+        )
+        row = await cursor.fetchone()
+    return row[0] if row else None
 
-        await db.commit()
 
+@timed
+async def release_lease(name: str, owner: str):
+    async with pool.writer() as db:
+        await db.execute(
+            "UPDATE leader_lease SET expires_at = 0 WHERE name = ? AND owner = ?",
+            (name, owner)
+        )
+
+
+async def _check_fence(db: aiosqlite.Connection, fence: Fence | None):
+    if fence is None:
+        return
+    name, token = fence
+    cursor = await db.execute(
+        "SELECT 1 FROM leader_lease WHERE name = ? AND token = ? AND expires_at > ?",
+        (name, token, time.time())
+    )
+    if await cursor.fetchone() is None:
+        raise LeaseLostError(f"Аренда {name} с токеном {token} больше не действует")
+
+
+@timed
+async def get_all_bookings() -> list[BookingRecord]:
+    async with pool.reader() as db:
+        rows = await db.execute_fetchall(f"SELECT {BOOKING_COLUMNS} FROM bookings")
+    return [BookingRecord(*row) for row in rows]
+
+
+@timed
+async def get_active_bookings() -> list[BookingRecord]:
+    now = int(datetime.now(timezone.utc).timestamp())
+    async with pool.reader() as db:
+        rows = await db.execute_fetchall(
+            f"SELECT {BOOKING_COLUMNS} FROM bookings WHERE start_ts > ? AND end_ts > ?",
+            (now - int(BOOKING_DURATION.total_seconds()), now)
+        )
+    return [BookingRecord(*row) for row in rows]
 
-async def get_all_bookings():
-    async with aiosqlite.connect(DB_PATH) as db:
+
+def to_start_ts(date: str, time: str) -> int:
+    naive_dt = datetime.strptime(date + f" {time}", "%d.%m.%Y %H:%M")
+    return int(naive_dt.replace(tzinfo=venue().tz).timestamp())
+
+
+def _local_time_modifier() -> str:
+    """Модификатор SQLite, переводящий unixepoch в местное время заведения.
+
+    Смещение берётся на текущий момент: в поясах заведений сейчас нет перехода на летнее время.
+    """
+    offset = venue().now().utcoffset()
+    return f"{int(offset.total_seconds()):+d} seconds"
+
+
+async def _slot_taken(db: aiosqlite.Connection, conflicts: list[str], start_ts: int, end_ts: int, user_id: int) -> bool:
+    # Длительность брони фиксирована, поэтому пересечение = начало в пределах ±BOOKING_DURATION:
+    # это диапазон по индексу (table_number, start_ts). Свой холд гостю не мешает.
+    # conflicts — все столы и сочетания столов, которые делят стол с бронируемым.
+    duration = int(BOOKING_DURATION.total_seconds())
+    placeholders = ", ".join("?" * len(conflicts))
+    cursor = await db.execute(
+        f"""
+        SELECT 1 FROM bookings
+        WHERE table_number IN ({placeholders}) AND start_ts > ? AND start_ts < ? AND end_ts > ?
+        UNION ALL
+        SELECT 1 FROM slot_holds
+        WHERE table_number IN ({placeholders}) AND start_ts > ? AND start_ts < ? AND end_ts > ?
+            AND expires_at > ? AND user_id <> ?
+        LIMIT 1
+        """,
+        (
+            *conflicts, start_ts - duration, end_ts, start_ts,
+            *conflicts, start_ts - duration, end_ts, start_ts, int(time.time()), user_id,
+        )
+    )
+    return await cursor.fetchone() is not None
+
+
+@timed
+async def hold_slot(
+    user_id: int, table_number: str, start_ts: int, conflicts: list[str] | None = None, ttl: timedelta = HOLD_TTL,
+    waitlist_id: int = 0,
+) -> bool:
+    """Атомарно проверяет стол и ставит на него холд на `ttl`.
+
+    Холд диалога (waitlist_id = 0) у гостя один и заменяется; холд предложения из листа
+    ожидания привязан к заявке и живёт независимо от диалога и других предложений.
+    """
+    end_ts = start_ts + int(BOOKING_DURATION.total_seconds())
+    async with pool.writer() as db:
+        if await _slot_taken(db, conflicts or [table_number], start_ts, end_ts, user_id):
+            return False
+        await db.execute(
+            """
+            INSERT OR REPLACE INTO slot_holds (user_id, waitlist_id, table_number, start_ts, end_ts, expires_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (user_id, waitlist_id, table_number, start_ts, end_ts, int(time.time() + ttl.total_seconds()))
+        )
+    return True
+
+
+@timed
+async def release_hold(user_id: int, waitlist_id: int = 0):
+    """Снимает один холд гостя: по умолчанию — холд диалога, с waitlist_id — холд предложения."""
+    async with pool.writer() as db:
+        await db.execute("DELETE FROM slot_holds WHERE user_id = ? AND waitlist_id = ?", (user_id, waitlist_id))
+
+
+async def _enqueue(db: aiosqlite.Connection, messages: list[OutboxMessage]):
+    if not messages:
+        return
+    await _bump_version(db, "outbox")
+    now = int(time.time())
+    await db.executemany(
+        "INSERT INTO outbox (chat_id, text, reply_markup, next_attempt_ts) VALUES (?, ?, ?, ?)",
+        [(chat_id, text, markup[0] if markup else None, now) for chat_id, text, *markup in messages]
+    )
+
+
+@timed
+async def save_booking(
+    user_id: int, table_number: str, guests: int, time: str, name: str, date: str,
+    compose_messages: ComposeMessages | None = None, conflicts: list[str] | None = None, phone: str = "",
+    waitlist_id: int | None = None,
+) -> BookingRecord:
+    """С waitlist_id заявка из листа ожидания снимается в той же транзакции, что и создаётся бронь."""
+    start_ts = to_start_ts(date, time)
+    end_ts = start_ts + int(BOOKING_DURATION.total_seconds())
+
+    # Проверка и вставка — в одной IMMEDIATE-транзакции, двойной брони не будет
+    async with pool.writer() as db:
+        if await _slot_taken(db, conflicts or [table_number], start_ts, end_ts, user_id):
+            raise ValueError("Бронь на это время уже существует")
+        if waitlist_id is None:
+            await db.execute("DELETE FROM slot_holds WHERE user_id = ? AND waitlist_id = 0", (user_id,))
+            unwaitlisted = []
+        else:
+            # Холд предложения снимается вместе с заявкой, холд диалога гостя не трогаем
+            unwaitlisted = await _delete_waitlist(db, [waitlist_id])
         cursor = await db.execute(
-            "SELECT user_id, table_number, time, name, booking_at FROM bookings"
+            "INSERT INTO bookings (user_id, table_number, guests, time, name, start_ts, end_ts, phone) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (user_id, table_number, guests, time, name, start_ts, end_ts, phone)
+        )
+        booking = BookingRecord(cursor.lastrowid, user_id, table_number, guests, time, name, start_ts, end_ts, phone)
+        await _bump_version(db, "bookings")
+        messages = compose_messages([booking]) if compose_messages else []
+        await _enqueue(db, messages)
+
+    _notify("saved", [booking])
+    _notify("unwaitlisted", unwaitlisted)
+    _notify("enqueued", messages)
+    return booking
+
+
+@timed
+async def get_booking(user_id) -> list[BookingRecord]:
+    async with pool.reader() as db:
+        rows = await db.execute_fetchall(
+            f"SELECT {BOOKING_COLUMNS} FROM bookings WHERE user_id = ? ORDER BY start_ts",
+            (user_id,)
+        )
+    return [BookingRecord(*row) for row in rows]
+
+
+async def _archive(db: aiosqlite.Connection, where: str, params, status: str) -> list[BookingRecord]:
+    # Копируем и удаляем в одной транзакции писателя: INSERT ... SELECT + DELETE ... RETURNING
+    await db.execute(
+        f"""
+        INSERT INTO bookings_archive ({BOOKING_COLUMNS}, created_at, status)
+        SELECT {BOOKING_COLUMNS}, created_at, ? FROM bookings WHERE {where}
+        """,
+        (status, *params)
+    )
+    cursor = await db.execute(f"DELETE FROM bookings WHERE {where} RETURNING {BOOKING_COLUMNS}", params)
+    removed = [BookingRecord(*row) for row in await cursor.fetchall()]
+    if removed:
+        await _bump_version(db, "bookings")
+    return removed
+
+
+@timed
+async def delete_booking(
+    booking_id: int, compose_messages: ComposeMessages | None = None, user_id: int | None = None,
+) -> BookingRecord | None:
+    """Отменяет бронь по id; с user_id — только если она принадлежит этому гостю."""
+    where, params = "id = ?", (booking_id,)
+    if user_id is not None:
+        where, params = "id = ? AND user_id = ?", (booking_id, user_id)
+    async with pool.writer() as db:
+        removed = await _archive(db, where, params, "cancelled")
+        messages = compose_messages(removed) if compose_messages and removed else []
+        await _enqueue(db, messages)
+
+    _notify("removed", removed)
+    _notify("enqueued", messages)
+    return removed[0] if removed else None
+
+
+@timed
+async def expire_bookings(
+    now_ts: int, compose_messages: ComposeMessages | None = None, fence: Fence | None = None,
+) -> list[BookingRecord]:
+    async with pool.writer() as db:
+        await _check_fence(db, fence)
+        expired = await _archive(db, "end_ts <= ?", (now_ts,), "completed")
+        await db.execute("DELETE FROM slot_holds WHERE expires_at <= ?", (now_ts,))
+        messages = compose_messages(expired) if compose_messages and expired else []
+        await _enqueue(db, messages)
+
+    _notify("removed", expired)
+    _notify("enqueued", messages)
+    return expired
+
+
+REMINDER_COLUMNS = "id, user_id, start_ts, notify_24_sent, notify_12_sent"
+
+
+@timed
+async def get_pending_reminders(now_ts: int):
+    async with pool.reader() as db:
+        return await db.execute_fetchall(
+            """
+            SELECT id, start_ts, CAST(strftime('%s', created_at) AS INTEGER), notify_24_sent, notify_12_sent
+            FROM bookings
+            WHERE start_ts > ? AND (notify_24_sent = 0 OR notify_12_sent = 0)
+            """,
+            (now_ts,)
+        )
+
+
+@timed
+async def get_reminders_by_ids(booking_ids):
+    booking_ids = list(booking_ids)
+    if not booking_ids:
+        return []
+    placeholders = ", ".join("?" * len(booking_ids))
+    async with pool.reader() as db:
+        return await db.execute_fetchall(
+            f"SELECT {REMINDER_COLUMNS} FROM bookings WHERE id IN ({placeholders})",
+            booking_ids
         )
-        return await cursor.fetchall()
-    
 
-async def booking_exists(table_number: str, booking_at: datetime) -> bool:
-    async with aiosqlite.connect(DB_PATH) as db:
+
+@timed
+async def mark_reminders_sent(sent: dict[int, list[int]], messages: list[OutboxMessage], fence: Fence | None = None):
+    """sent: {часы напоминания: [id броней]}; флаги и сообщения пишутся одной транзакцией."""
+    if set(sent) - {24, 12}:
+        raise ValueError(f"Неизвестное напоминание: {sorted(sent)}")
+    async with pool.writer() as db:
+        await _check_fence(db, fence)
+        for hours, booking_ids in sent.items():
+            await db.executemany(
+                f"UPDATE bookings SET notify_{hours}_sent = 1 WHERE id = ?",
+                [(booking_id,) for booking_id in booking_ids]
+            )
+        await _enqueue(db, messages)
+
+    _notify("enqueued", messages)
+
+
+@timed
+async def claim_outbox(now_ts: int, limit: int, lease: int):
+    # Забираем пачку сообщений в работу: сдвигаем next_attempt_ts на время аренды,
+    # чтобы при падении воркера сообщение ушло повторно
+    if limit <= 0:
+        return []
+    async with pool.writer() as db:
         cursor = await db.execute(
             """
-            SELECT 1 FROM bookings
-            WHERE table_number = ? AND ABS(strftime('%s', booking_at) - strftime('%s', ?)) < 7200
+            UPDATE outbox SET next_attempt_ts = ?
+            WHERE id IN (
+                SELECT id FROM outbox WHERE next_attempt_ts <= ? ORDER BY id LIMIT ?
+            )
+            RETURNING id, chat_id, text, reply_markup, attempts
             """,
-            (table_number, booking_at.isoformat())
+            (now_ts + lease, now_ts, limit)
         )
-        return await cursor.fetchone() is not None
+        rows = await cursor.fetchall()
+    return sorted(rows)
 
 
-async def save_booking(user_id: int, table_number: str, time: str, name: str, date: str):
-    day = datetime.strptime(date, "%d.%m.%Y")
-    hour, minute = map(int, time.split(":"))
-    naive_dt = datetime.strptime(date + f" {time}", "%d.%m.%Y %H:%M")
-    booking_at = naive_dt.replace(tzinfo=MSK).astimezone(timezone.utc)
-    if await booking_exists(table_number, booking_at):
-        raise ValueError("Бронь на это время уже существует")
+@timed
+async def next_outbox_due() -> int | None:
+    async with pool.reader() as db:
+        cursor = await db.execute("SELECT MIN(next_attempt_ts) FROM outbox")
+        (next_ts,) = await cursor.fetchone()
+    return next_ts
+
+
+@timed
+async def outbox_size() -> int:
+    async with pool.reader() as db:
+        cursor = await db.execute("SELECT COUNT(*) FROM outbox")
+        (size,) = await cursor.fetchone()
+    return size
+
+
+@timed
+async def delete_outbox_message(message_id: int):
+    async with pool.writer() as db:
+        await db.execute("DELETE FROM outbox WHERE id = ?", (message_id,))
+
+
+@timed
+async def retry_outbox_message(message_id: int, next_attempt_ts: int, count_attempt: bool = True):
+    async with pool.writer() as db:
+        await db.execute(
+            "UPDATE outbox SET next_attempt_ts = ?, attempts = attempts + ? WHERE id = ?",
+            (next_attempt_ts, int(count_attempt), message_id)
+        )
+
+
+@timed
+async def get_day_schedule(from_ts: int, to_ts: int) -> list[BookingRecord]:
+    """Брони, начинающиеся в [from_ts, to_ts): актуальные и уже завершённые из архива."""
+    async with pool.reader() as db:
+        rows = await db.execute_fetchall(
+            f"""
+            SELECT {BOOKING_COLUMNS} FROM bookings WHERE start_ts >= ? AND start_ts < ?
+            UNION ALL
+            SELECT {BOOKING_COLUMNS} FROM bookings_archive
+            WHERE start_ts >= ? AND start_ts < ? AND status = 'completed'
+            ORDER BY start_ts
+            """,
+            (from_ts, to_ts, from_ts, to_ts)
+        )
+    return [BookingRecord(*row) for row in rows]
+
+
+EXPORT_COLUMNS = (
+    "id", "status", "user_id", "table_number", "guests", "name", "phone",
+    "start", "end", "created_at", "archived_at",
+)
+EXPORT_BATCH = 500
+
+
+async def iter_export_rows(batch: int = EXPORT_BATCH):
+    """Все брони — актуальные и архивные — построчно, пачками по `batch` через курсор.
+
+    Соединение-читатель занято до конца обхода, в памяти не больше одной пачки.
+    """
+    # Время — местное для заведения, как его видят гости и менеджеры; created_at и
+    # archived_at — CURRENT_TIMESTAMP, то есть текст в UTC, а не unixepoch
+    local = "datetime({column}, 'unixepoch', :tz)"
+    stamp = "datetime({column}, :tz)"
+    query = f"""
+        SELECT id, 'active', user_id, table_number, guests, name, phone,
+            {local.format(column="start_ts")}, {local.format(column="end_ts")}, {stamp.format(column="created_at")}, NULL
+        FROM bookings
+        UNION ALL
+        SELECT id, status, user_id, table_number, guests, name, phone,
+            {local.format(column="start_ts")}, {local.format(column="end_ts")},
+            {stamp.format(column="created_at")}, {stamp.format(column="archived_at")}
+        FROM bookings_archive
+    """
+    async with pool.reader() as db:
+        async with db.execute(query, {"tz": _local_time_modifier()}) as cursor:
+            while rows := await cursor.fetchmany(batch):
+                for row in rows:
+                    yield row
+
+
+@timed
+async def occupancy_report(from_ts: int, to_ts: int, open_seconds_per_day: int) -> dict:
+    """Агрегаты по броням, начавшимся в [from_ts, to_ts); всё считает SQLite."""
+    # Состоявшиеся брони: актуальные и завершённые; отменённые — только для доли отмен
+    held = """
+        SELECT table_number, guests, start_ts, end_ts FROM bookings WHERE start_ts >= :from AND start_ts < :to
+        UNION ALL
+        SELECT table_number, guests, start_ts, end_ts FROM bookings_archive
+        WHERE start_ts >= :from AND start_ts < :to AND status = 'completed'
+    """
+    params = {
+        "from": from_ts, "to": to_ts, "tz": _local_time_modifier(),
+        "open": open_seconds_per_day * max(1, (to_ts - from_ts) // 86400),
+    }
+    async with pool.reader() as db:
+        covers = await db.execute_fetchall(
+            f"""
+            SELECT date(start_ts, 'unixepoch', :tz) AS day, COUNT(*), SUM(guests)
+            FROM ({held}) GROUP BY day ORDER BY day
+            """,
+            params
+        )
+        utilization = await db.execute_fetchall(
+            f"""
+            SELECT table_number, COUNT(*), ROUND(100.0 * SUM(end_ts - start_ts) / :open, 1) AS percent
+            FROM ({held}) GROUP BY table_number ORDER BY percent DESC
+            """,
+            params
+        )
+        # Каждая бронь занимает несколько получасов подряд — раскладываем её по ним рекурсивным CTE
+        peaks = await db.execute_fetchall(
+            f"""
+            WITH RECURSIVE held AS ({held}),
+            slots(slot_ts, end_ts, guests) AS (
+                SELECT start_ts - start_ts % 1800, end_ts, guests FROM held
+                UNION ALL
+                SELECT slot_ts + 1800, end_ts, guests FROM slots WHERE slot_ts + 1800 < end_ts
+            )
+            SELECT strftime('%H:%M', slot_ts % 86400, 'unixepoch', :tz) AS half_hour,
+                COUNT(*) AS tables, SUM(guests)
+            FROM slots GROUP BY half_hour ORDER BY tables DESC, half_hour LIMIT 5
+            """,
+            params
+        )
+        cursor = await db.execute(
+            """
+            SELECT
+                (SELECT COUNT(*) FROM bookings WHERE start_ts >= :from AND start_ts < :to),
+                COUNT(*) FILTER (WHERE status = 'completed'),
+                COUNT(*) FILTER (WHERE status = 'cancelled')
+            FROM bookings_archive WHERE start_ts >= :from AND start_ts < :to
+            """,
+            params
+        )
+        active, completed, cancelled = await cursor.fetchone()
+    total = active + completed + cancelled
+    return {
+        "covers": covers,
+        "utilization": utilization,
+        "peaks": peaks,
+        "bookings": total,
+        "cancelled": cancelled,
+        "cancellation_rate": round(100 * cancelled / total, 1) if total else 0.0,
+    }
+
+
+@timed
+async def get_dashboard_messages(chat_id: int) -> dict[str, int]:
+    async with pool.reader() as db:
+        return dict(await db.execute_fetchall(
+            "SELECT day, message_id FROM dashboard_messages WHERE chat_id = ?", (chat_id,)
+        ))
+
+
+@timed
+async def save_dashboard_message(day: str, chat_id: int, message_id: int):
+    async with pool.writer() as db:
+        await db.execute(
+            "INSERT OR REPLACE INTO dashboard_messages (day, chat_id, message_id) VALUES (?, ?, ?)",
+            (day, chat_id, message_id)
+        )
+
+
+@timed
+async def delete_dashboard_message(day: str):
+    async with pool.writer() as db:
+        await db.execute("DELETE FROM dashboard_messages WHERE day = ?", (day,))
 
-    async with aiosqlite.connect(DB_PATH) as db:
+
+@timed
+async def get_media_file_id(content_hash: str) -> str | None:
+    async with pool.reader() as db:
+        cursor = await db.execute("SELECT file_id FROM media_files WHERE content_hash = ?", (content_hash,))
+        row = await cursor.fetchone()
+    return row[0] if row else None
+
+
+@timed
+async def save_media_file_id(content_hash: str, file_id: str):
+    async with pool.writer() as db:
         await db.execute(
-            "INSERT INTO bookings (user_id, table_number, time, name, booking_at) VALUES (?, ?, ?, ?, ?)",
-            (user_id, table_number, time, name, booking_at.isoformat())
+            "INSERT OR REPLACE INTO media_files (content_hash, file_id) VALUES (?, ?)",
+            (content_hash, file_id)
         )
-        await db.commit()
 
 
+@timed
+async def delete_media_file_id(content_hash: str):
+    async with pool.writer() as db:
+        await db.execute("DELETE FROM media_files WHERE content_hash = ?", (content_hash,))
 
 
-async def get_booking(user_id):
-    async with aiosqlite.connect(DB_PATH) as db:
+@timed
+async def add_to_waitlist(
+    user_id: int, day: str, first_slot: int, last_slot: int, guests: int, name: str, phone: str,
+) -> WaitlistEntry:
+    """Ставит гостя в лист ожидания; повторная заявка на тот же день заменяет прежнюю."""
+    async with pool.writer() as db:
+        replaced = await db.execute_fetchall(
+            f"DELETE FROM waitlist WHERE user_id = ? AND day = ? RETURNING {WAITLIST_COLUMNS}", (user_id, day)
+        )
         cursor = await db.execute(
-            """
-            SELECT id, table_number, time, name, created_at, booking_at
-            FROM bookings
-            WHERE user_id = ?
+            f"""
+            INSERT INTO waitlist (user_id, day, first_slot, last_slot, guests, name, phone)
+            VALUES (?, ?, ?, ?, ?, ?, ?) RETURNING {WAITLIST_COLUMNS}
             """,
-            (user_id,)
+            (user_id, day, first_slot, last_slot, guests, name, phone)
         )
-        return await cursor.fetchall()
+        entry = WaitlistEntry(*await cursor.fetchone())
+        await _bump_version(db, "waitlist")
 
+    _notify("unwaitlisted", [WaitlistEntry(*row) for row in replaced])
+    _notify("waitlisted", [entry])
+    return entry
 
-async def delete_booking(booking_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("DELETE FROM bookings WHERE id = ?", (booking_id,))
-        await db.commit()
 
+@timed
+async def get_waitlist(from_day: str) -> list[WaitlistEntry]:
+    async with pool.reader() as db:
+        rows = await db.execute_fetchall(
+            f"SELECT {WAITLIST_COLUMNS} FROM waitlist WHERE day >= ? ORDER BY id", (from_day,)
+        )
+    return [WaitlistEntry(*row) for row in rows]
 
 
-async def reminder_loop(bot: Bot):
-    while True:
-        try:
-            now_utc = datetime.now(timezone.utc)
-            now_msk = now_utc.astimezone(MSK)
-
-            for delta in [24, 12]:
-                target_msk = now_msk + timedelta(hours=delta)
-
-                window_start = target_msk - timedelta(minutes=2)
-                window_end = target_msk + timedelta(minutes=3)
-
-                async with aiosqlite.connect(DB_PATH) as db:
-                    async with db.execute("""
-                        SELECT user_id, table_number, booking_at, notify_24_sent, notify_12_sent
-                        FROM bookings
-                    """) as cursor:
-                        bookings = await cursor.fetchall()
-
-                    for user_id, table, booking_at_str, notify_24, notify_12 in bookings:
-                        booking_at = datetime.fromisoformat(booking_at_str)
-
-                        booking_at_msk = booking_at.astimezone(MSK)
-
-                        if window_start <= booking_at_msk < window_end:
-                            if delta == 24 and not notify_24:
-                                await bot.send_message(
-                                    user_id,
-                                    f"⏰ Напоминание: у вас бронь стола — в {booking_at_msk.strftime('%H:%M')}!\n"
-                                    f"Для отмены введите /start и перейдите в 'мои брони'"
-                                )
-                                await db.execute(
-                                    "UPDATE bookings SET notify_24_sent = 1 WHERE user_id = ? AND booking_at = ?",
-                                    (user_id, booking_at_str)
-                                )
-
-                            elif delta == 12 and not notify_12:
-                                await bot.send_message(
-                                    user_id,
-                                    f"⏰ Напоминание: у вас бронь стола через — в {booking_at_msk.strftime('%H:%M')}!\n"
-                                    f"Для отмены введите /start и перейдите в 'мои брони'"
-                                )
-                                await db.execute(
-                                    "UPDATE bookings SET notify_12_sent = 1 WHERE user_id = ? AND booking_at = ?",
-                                    (user_id, booking_at_str)
-                                )
-
-                    await db.commit()
-
-        except Exception as e:
-            logging.exception("Ошибка в reminder_loop")
-
-        await asyncio.sleep(60)
-
-
-async def delete_booking_by_user_and_time(user_id: int, booking_at: str):
-    async with aiosqlite.connect(DB_PATH) as db:
+@timed
+async def get_waitlist_entry(entry_id: int, user_id: int) -> WaitlistEntry | None:
+    async with pool.reader() as db:
+        cursor = await db.execute(
+            f"SELECT {WAITLIST_COLUMNS} FROM waitlist WHERE id = ? AND user_id = ?", (entry_id, user_id)
+        )
+        row = await cursor.fetchone()
+    return WaitlistEntry(*row) if row else None
+
+
+@timed
+async def set_waitlist_offer(
+    entry_id: int, table_number: str, start_ts: int, expires_at: int, fence: Fence | None = None,
+    messages: list[OutboxMessage] = (),
+) -> WaitlistEntry | None:
+    """Записывает предложение стола; messages уходят в outbox в той же транзакции, если заявка ещё есть."""
+    messages = list(messages)
+    async with pool.writer() as db:
+        await _check_fence(db, fence)
+        cursor = await db.execute(
+            f"""
+            UPDATE waitlist SET offer_table = ?, offer_start_ts = ?, offer_expires_at = ?
+            WHERE id = ? RETURNING {WAITLIST_COLUMNS}
+            """,
+            (table_number, start_ts, expires_at, entry_id)
+        )
+        row = await cursor.fetchone()
+        if row:
+            await _bump_version(db, "waitlist")
+            await _enqueue(db, messages)
+
+    if row:
+        _notify("enqueued", messages)
+    return WaitlistEntry(*row) if row else None
+
+
+async def _delete_waitlist(db: aiosqlite.Connection, entry_ids: list[int]) -> list[WaitlistEntry]:
+    placeholders = ", ".join("?" * len(entry_ids))
+    rows = await db.execute_fetchall(
+        f"DELETE FROM waitlist WHERE id IN ({placeholders}) RETURNING {WAITLIST_COLUMNS}", entry_ids
+    )
+    # Вместе с заявкой уходит и холд её предложения: стол снова свободен для остальных
+    await db.execute(f"DELETE FROM slot_holds WHERE waitlist_id IN ({placeholders})", entry_ids)
+    if rows:
+        await _bump_version(db, "waitlist")
+    return [WaitlistEntry(*row) for row in rows]
+
+
+@timed
+async def delete_waitlist_entries(
+    entry_ids, user_id: int | None = None, fence: Fence | None = None,
+    compose_messages: Callable[[list[WaitlistEntry]], list[OutboxMessage]] | None = None,
+) -> list[WaitlistEntry]:
+    """Снимает заявки; с user_id — только заявки этого гостя. Сообщения о снятых — в той же транзакции."""
+    entry_ids = list(entry_ids)
+    if not entry_ids:
+        return []
+    async with pool.writer() as db:
+        await _check_fence(db, fence)
+        if user_id is not None:
+            placeholders = ", ".join("?" * len(entry_ids))
+            entry_ids = [row[0] for row in await db.execute_fetchall(
+                f"SELECT id FROM waitlist WHERE id IN ({placeholders}) AND user_id = ?", (*entry_ids, user_id)
+            )]
+        removed = await _delete_waitlist(db, entry_ids) if entry_ids else []
+        messages = compose_messages(removed) if compose_messages and removed else []
+        await _enqueue(db, messages)
+
+    _notify("enqueued", messages)
+    _notify("unwaitlisted", removed)
+    return removed
+
+
+@timed
+async def load_fsm_state(key: str):
+    async with fsm_pool.reader() as db:
+        cursor = await db.execute("SELECT state, data FROM fsm_state WHERE key = ?", (key,))
+        return await cursor.fetchone()
+
+
+@timed
+async def save_fsm_state(key: str, state: str | None, data: str, updated_at: int):
+    """Записывает state и data (JSON) диалога одним запросом; пустой диалог удаляется, а не хранится."""
+    async with fsm_pool.writer() as db:
+        if state is None and data == "{}":
+            await db.execute("DELETE FROM fsm_state WHERE key = ?", (key,))
+            return
         await db.execute(
-            "DELETE FROM bookings WHERE user_id = ? AND booking_at = ?",
-            (user_id, booking_at)
+            """
+            INSERT INTO fsm_state (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET state = excluded.state, data = excluded.data, updated_at = excluded.updated_at
+            """,
+            (key, state, data, updated_at)
         )
-        await db.commit()
 
+
+@timed
+async def delete_stale_fsm_states(before_ts: int) -> int:
+    async with fsm_pool.writer() as db:
+        cursor = await db.execute("DELETE FROM fsm_state WHERE updated_at < ?", (before_ts,))
+        return cursor.rowcount
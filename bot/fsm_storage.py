@@ -0,0 +1,105 @@
+import asyncio
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, Mapping
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+
+from db import load_fsm_state, save_fsm_state, delete_stale_fsm_states
+
+
+CLEANUP_INTERVAL = 60
+
+# Диалоги, прочитанные в текущем апдейте: ключ -> [state, data, изменён ли]
+_buffer: ContextVar[dict[str, list] | None] = ContextVar("fsm_buffer", default=None)
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище в SQLite без кэша между апдейтами.
+
+    Следующий апдейт гостя может прийти на другой экземпляр бота за балансировщиком,
+    поэтому каждый апдейт читает диалог из базы заново. Внутри одного апдейта
+    (см. buffered и middlewares.fsm_buffer) диалог читается один раз, а все
+    set_state и set_data копятся в памяти и пишутся одним запросом, когда хендлер
+    отработал. Вне буфера каждый вызов сам себе апдейт.
+    """
+
+    def __init__(self, ttl: float, key_builder: DefaultKeyBuilder | None = None):
+        self.ttl = ttl
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self._cleaner: asyncio.Task | None = None
+        self._last_cleanup = time.monotonic()
+
+    @asynccontextmanager
+    async def buffered(self):
+        if _buffer.get() is not None:
+            yield
+            return
+        dialogs = {}
+        token = _buffer.set(dialogs)
+        try:
+            yield
+        finally:
+            _buffer.reset(token)
+            await self._flush(dialogs)
+
+    async def _dialog(self, key: StorageKey) -> list:
+        dialogs = _buffer.get()
+        built = self.key_builder.build(key)
+        dialog = dialogs.get(built)
+        if dialog is None:
+            row = await load_fsm_state(built)
+            dialog = dialogs[built] = [row[0], json.loads(row[1]), False] if row else [None, {}, False]
+        return dialog
+
+    async def _flush(self, dialogs: dict[str, list]):
+        now = int(time.time())
+        for key, (state, data, changed) in dialogs.items():
+            if changed:
+                await save_fsm_state(key, state, json.dumps(data, ensure_ascii=False), now)
+                self._cleanup_later()
+
+    def _cleanup_later(self):
+        # Брошенные диалоги удаляются попутно с записями, не чаще раза в CLEANUP_INTERVAL
+        if time.monotonic() - self._last_cleanup < CLEANUP_INTERVAL:
+            return
+        if self._cleaner is None or self._cleaner.done():
+            self._last_cleanup = time.monotonic()
+            self._cleaner = asyncio.create_task(self._cleanup())
+
+    async def _cleanup(self):
+        try:
+            removed = await delete_stale_fsm_states(int(time.time() - self.ttl))
+            if removed:
+                logging.info("Удалено %s брошенных диалогов", removed)
+        except Exception:
+            logging.exception("Ошибка при удалении брошенных диалогов")
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        async with self.buffered():
+            dialog = await self._dialog(key)
+            dialog[0] = state.state if isinstance(state, State) else state
+            dialog[2] = True
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        async with self.buffered():
+            return (await self._dialog(key))[0]
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        async with self.buffered():
+            dialog = await self._dialog(key)
+            dialog[1] = dict(data)
+            dialog[2] = True
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        async with self.buffered():
+            # Копия: хендлер может менять словарь, не трогая ещё не записанный диалог
+            return dict((await self._dialog(key))[1])
+
+    async def close(self) -> None:
+        if self._cleaner is not None and not self._cleaner.done():
+            await self._cleaner
@@ -5,22 +5,31 @@ from aiogram.fsm.context import FSMContext
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
-from collections import defaultdict
+from aiogram.exceptions import TelegramBadRequest
 
-from datetime import datetime, timedelta, timezone, time
+import time
+from datetime import date, datetime, time as dtime, timedelta
 from pathlib import Path
-from db import save_booking, get_booking, delete_booking, get_all_bookings
+from db import (
+    save_booking, delete_booking, hold_slot, release_hold, to_start_ts,
+    add_to_waitlist, get_waitlist_entry, delete_waitlist_entries,
+)
+from availability import index as availability, slot_of, slot_label
+from allocation import inventory, allocate, free_starts, free_units
+from keyboards import markup_cache
+from user_bookings import user_bookings
+from dashboard import starts_soon
+from media import media
+from waitlist import OFFER_TTL
+from venues import venue, all_venues, get_venue, use_venue
 
 
 IMG_PATH = Path(__file__).parent / "img" / "booking_img.png"
 router = Router()
 
-TABLES = {
-    8: ["T8_1"],
-    6: ["T6_1"],
-    3: [f"T3_{i}" for i in range(1, 7)]
-}
-
+BOOKING_DAYS = 14
+# Границы окон листа ожидания; крайние окна обрезаются часами работы заведения
+WAITLIST_BOUNDS = (dtime(12, 0), dtime(16, 0), dtime(20, 0))
 
 
 class Booking(StatesGroup):
@@ -31,49 +40,135 @@ class Booking(StatesGroup):
     phone = State()
 
 
-async def find_next_available_slot(guests: int, selected_dt: datetime, all_bookings):
-    tables = TABLES.get(guests)
-    if not tables:
-        return None, None
+def _slot(at: dtime) -> int:
+    return slot_of(at.hour, at.minute)
 
-    bookings_by_table = defaultdict(list)
-    selected_date = selected_dt.date()
 
-    # Группируем брони по столам
-    for _, table, _, _, booking_at_str in all_bookings:
-        booking_at = datetime.fromisoformat(booking_at_str).replace(tzinfo=timezone.utc)
-        if booking_at.date() == selected_date:
-            bookings_by_table[table].append(booking_at)
+def booking_window() -> tuple[int, int]:
+    """Первый и последний слот начала, которые предлагаются гостю в текущем заведении."""
+    return _slot(venue().opens), _slot(venue().last_start)
 
-    for table_id in tables:
-        occupied = bookings_by_table.get(table_id, [])
-        occupied.sort()
 
-        # Проверка текущего слота
-        slot_start = selected_dt
-        slot_end = slot_start + timedelta(hours=2)
+def last_seating_slot() -> int:
+    return _slot(venue().last_seating)
+
+
+def waitlist_windows() -> list[tuple[str, int, int]]:
+    """Окна для листа ожидания: (подпись, первый и последний слот начала)."""
+    first, last = booking_window()[0], last_seating_slot()
+    windows = [("Любое время", first, last)]
+    bounds = [_slot(bound) for bound in WAITLIST_BOUNDS] + [last]
+    for start, end in zip(bounds, bounds[1:]):
+        start, end = max(start, first), min(end, last)
+        if start < end:
+            windows.append((f"{slot_label(start)}–{slot_label(end)}", start, end))
+    return windows
+
+
+def first_slot_for(day: date, now: datetime) -> int:
+    # Сегодня — только слоты позже текущего времени
+    first_slot = booking_window()[0]
+    if day == now.date():
+        return max(first_slot, slot_of(now.hour, now.minute) + 1)
+    return first_slot
+
+
+def capacity_overview(now: datetime) -> dict[date, dict[int, int]]:
+    """Свободные столы по дням горизонта и вместимости: {дата: {мест: столов}}."""
+    overview = {}
+    for i in range(BOOKING_DAYS):
+        day = now.date() + timedelta(days=i)
+        overview[day] = free_units(day, first_slot_for(day, now), booking_window()[1])
+    return overview
+
+
+def dates_markup(now: datetime) -> InlineKeyboardMarkup:
+    # Полностью занятые дни видно сразу, без захода в выбор гостей и времени
+    builder = InlineKeyboardBuilder()
+    for day, free in capacity_overview(now).items():
+        date_str = day.strftime("%d.%m.%Y")
+        if any(free.values()):
+            builder.button(text=date_str, callback_data=f"date_{date_str}")
+        else:
+            builder.button(text=f"🚫 {date_str}", callback_data=f"full_{date_str}")
+    builder.adjust(2)
+    return builder.as_markup()
+
+
+def guests_markup(free: dict[int, int]) -> InlineKeyboardMarkup:
+    # Только такие компании, для которых в этот день есть хоть один свободный стол
+    builder = InlineKeyboardBuilder()
+    for guests in range(1, inventory.max_guests + 1):
+        if any(count for seats, count in free.items() if seats >= guests):
+            builder.button(text=str(guests), callback_data=f"guests_{guests}")
+    builder.adjust(5)
+    return builder.as_markup()
 
-        conflict = any(
-            not (b + timedelta(hours=2) <= slot_start or b >= slot_end)
-            for b in occupied
-        )
-        if not conflict:
-            return table_id, selected_dt
 
-        # Поиск ближайшего свободного слота позже
-        test_start = max(slot_end, max(occupied) + timedelta(minutes=30) if occupied else slot_start)
-        while test_start.hour < 23:
-            test_end = test_start + timedelta(hours=2)
-            if all(
-                b + timedelta(hours=2) <= test_start or b >= test_end
-                for b in occupied
-            ):
-                return table_id, test_start
-            test_start += timedelta(minutes=30)
+def times_markup(day: date, guests: int, first_slot: int, last_slot: int) -> InlineKeyboardMarkup:
+    # Кнопки только для времени, с которого свободен хотя бы один подходящий стол
+    available = free_starts(day, guests)
+    builder = InlineKeyboardBuilder()
+    for slot in range(first_slot, last_slot + 1):
+        if available >> slot & 1:
+            time_str = slot_label(slot)
+            builder.button(text=time_str, callback_data=f"time_{time_str}")
+    builder.adjust(3)
+    return builder.as_markup()
+
 
-    return None, None
+def waitlist_markup() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="📝 Встать в лист ожидания", callback_data="waitlist")
+    ]])
+
+
+def new_booking_alert(date_str: str, time_str: str, guests: int, name: str, phone: str) -> str:
+    return (
+        f"📢 Новая бронь!\n"
+        f"📅 Дата: {date_str}\n"
+        f"⏰ Время: {time_str}\n"
+        f"👥 Кол-во гостей: {guests}\n"
+        f"👤 Имя: {str(name).capitalize()}\n"
+        f"📞 Телефон: {phone}"
+    )
+
+
+def confirmation_caption(date_str: str, time_str: str, guests: int, name: str) -> str:
+    return (
+        f"Спасибо {str(name).capitalize()}! Ваше бронирование на {guests} гостей, {date_str}, в {time_str}.\n"
+        f"Отличный отдых теперь гарантирован! Хотим сообщить что длительность бронирования составляет 2 часа, "
+        f"если у нас будет возможность мы с радостью продлим это время 🤍"
+    )
 
 
+async def hold_table(user_id: int, guests: int, day: date, slot: int):
+    """Ставит холд на первый свободный стол; если столы разобрали параллельно — пробует следующий."""
+    start_ts = to_start_ts(day.strftime("%d.%m.%Y"), slot_label(slot))
+    taken = set()
+    while True:
+        # Сначала самый маленький подходящий стол на выбранное время, иначе — ближайшее время позже
+        unit, free_slot = allocate(day, guests, slot, max(slot, last_seating_slot()), exclude=taken)
+        if unit is None or free_slot != slot:
+            return None, free_slot
+        if await hold_slot(user_id, unit.id, start_ts, conflicts=inventory.conflicts(unit.id)):
+            return unit.id, slot
+        taken.add(unit.id)
+
+
+def callback_venue(parts: list[str]) -> str:
+    """id заведения из хвоста callback data; у кнопок из старых сообщений его нет — тогда текущее."""
+    venue_id = parts[0] if parts else venue().id
+    return venue_id if get_venue(venue_id) is not None else venue().id
+
+
+def venues_markup() -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    for item in all_venues():
+        builder.button(text=item.name, callback_data=f"venue_{item.id}")
+    builder.adjust(1)
+    return builder.as_markup()
+
 
 @router.message(F.text == "/start")
 async def send_welcome(msg: Message):
@@ -85,121 +180,157 @@ async def send_welcome(msg: Message):
         resize_keyboard=True,
         one_time_keyboard=False
     )
-    await msg.answer("Добрый день! На связи Метеорит, в этом боте можно забронировать стол или посмотреть действующее бронирование?",\
-                    reply_markup=keyboard)
+    await media.answer_photo(
+        msg, IMG_PATH,
+        caption=f"Добрый день! На связи {venue().name}, в этом боте можно забронировать стол или посмотреть действующее бронирование?",
+        reply_markup=keyboard
+    )
+    if len(all_venues()) > 1:
+        await msg.answer("В каком заведении бронируем?", reply_markup=venues_markup())
 
 
-@router.message(F.text == "Мои брони")
-async def my_bookings(msg: Message):
-    bookings = await get_booking(msg.from_user.id)
-    if not bookings:
-        await msg.answer("У тебя пока нет активных броней.")
+@router.callback_query(F.data.startswith("venue_"))
+async def choose_venue(callback: CallbackQuery, state: FSMContext):
+    selected = get_venue(callback.data.replace("venue_", ""))
+    if selected is None:
         return
+    # Дальше VenueMiddleware берёт заведение из данных диалога
+    await release_hold(callback.from_user.id)
+    await state.set_state(None)
+    await state.set_data({"venue": selected.id})
+    await callback.message.answer(f"📍 {selected.name}, {selected.address}")
 
-    text = "📝 Твои брони:\n\n"
-    for booking in bookings:
-        # если get_booking возвращает: (id, table, time, name, created_at, booking_at)
-        booking_id, table, time, name, created_at, booking_at = booking
-        booking_fmt = datetime.fromisoformat(booking_at).strftime("%d.%m.%Y")
-        text = (
-            f"📅 Дата: {booking_fmt}\n"
-            f"🪑 Стол {table} на {time}\n"
-            f"👤 Имя: {name}"
-        )
-        keyboard = InlineKeyboardMarkup(
-            inline_keyboard=[
-                [InlineKeyboardButton(text="❌ Отменить", callback_data=f"cancel_{booking_id}")]
-            ]
-        )
-        await msg.answer(text, reply_markup=keyboard)
 
+async def end_dialog(state: FSMContext):
+    # Диалог закончен, но выбранное заведение остаётся за гостем
+    await state.set_state(None)
+    await state.set_data({"venue": venue().id})
 
-@router.callback_query(F.data.startswith("cancel_"))
-async def cancel_booking(callback: CallbackQuery, bot):
-    booking_id = int(callback.data.split("_")[1])
 
-    # Получаем все брони пользователя
-    bookings = await get_booking(callback.from_user.id)
-    cancelled = None
+async def all_user_bookings(user_id: int) -> list:
+    """Брони гостя во всех заведениях: [(заведение, бронь)]."""
+    found = []
+    for item in all_venues():
+        with use_venue(item.id):
+            found.extend((item, booking) for booking in await user_bookings.get(user_id))
+    return found
 
-    for b in bookings:
-        b_id, table, time, name, created_at, booking_at = b
-        if b_id == booking_id:
-            cancelled = b
-            break
 
-    await delete_booking(booking_id)
-    await callback.message.answer("Бронь успешно отменена ✅")
+def bookings_view(bookings) -> tuple[str, InlineKeyboardMarkup | None]:
+    """Все брони гостя одним сообщением, под ним — по кнопке отмены на каждую."""
+    if not bookings:
+        return "У тебя пока нет активных броней.", None
+
+    lines = ["📝 Твои брони:"]
+    buttons = []
+    for number, (place, booking) in enumerate(bookings, start=1):
+        start = datetime.fromtimestamp(booking.start_ts, place.tz)
+        where = f"📍 {place.name}\n" if len(all_venues()) > 1 else ""
+        lines.append(
+            f"\n{number}. 📅 {start.strftime('%d.%m.%Y')} в {booking.time}\n"
+            f"{where}"
+            f"👥 Гостей: {booking.guests}\n"
+            f"👤 Имя: {booking.name}"
+        )
+        buttons.append([InlineKeyboardButton(
+            text=f"❌ Отменить {number} — {start.strftime('%d.%m')} {booking.time}",
+            callback_data=f"cancel_{booking.id}_{place.id}",
+        )])
+    return "\n".join(lines), InlineKeyboardMarkup(inline_keyboard=buttons)
+
 
-    if cancelled:
-        manager_chat_id = -4980377325
-        booking_fmt = datetime.fromisoformat(cancelled[5]).astimezone(timezone(timedelta(hours=3))).strftime("%d.%m.%Y %H:%M")
-        await bot.send_message(
-            manager_chat_id,
+@router.message(F.text == "Мои брони")
+async def my_bookings(msg: Message):
+    text, keyboard = bookings_view(await all_user_bookings(msg.from_user.id))
+    await msg.answer(text, reply_markup=keyboard)
+
+
+def cancel_alert(cancelled):
+    # Остальные отмены менеджеры увидят в закреплённом расписании дня
+    messages = []
+    for booking in filter(starts_soon, cancelled):
+        booking_fmt = datetime.fromtimestamp(booking.start_ts, venue().tz).strftime("%d.%m.%Y %H:%M")
+        messages.append((
+            venue().manager_chat_id,
             f"❌ Отмена брони:\n"
             f"📅 {booking_fmt}\n"
-            f"👥 Гостей: {cancelled[1]}\n"
-            f"👤 Имя: {cancelled[3]}"
+            f"👥 Гостей: {booking.guests}\n"
+            f"👤 Имя: {booking.name}"
+        ))
+    return messages
+
+
+@router.callback_query(F.data.startswith("cancel_"), flags={"answer_callback": False})
+async def cancel_booking(callback: CallbackQuery):
+    _, booking_id, *rest = callback.data.split("_")
+
+    # Одним запросом по ключу: чужую бронь по подделанному callback не отменить.
+    # Уведомление менеджеру ставится в outbox в той же транзакции, что и удаление
+    with use_venue(callback_venue(rest)):
+        cancelled = await delete_booking(
+            int(booking_id), compose_messages=cancel_alert, user_id=callback.from_user.id
         )
+    await callback.answer("Бронь успешно отменена ✅" if cancelled else "Эта бронь уже отменена")
+
+    # Перерисовываем список на месте вместо нового сообщения
+    if not isinstance(callback.message, Message):
+        return
+    text, keyboard = bookings_view(await all_user_bookings(callback.from_user.id))
+    try:
+        await callback.message.edit_text(text, reply_markup=keyboard)
+    except TelegramBadRequest:
+        # Сообщение не изменилось или уже недоступно для редактирования
+        pass
 
 
 # Создаём кнопки времени с шагом в 1 час
 @router.message(F.text == "Забронировать стол")
 async def start_booking(msg: Message, state: FSMContext):
     await state.set_state(Booking.date)
+    # Новое бронирование — отпускаем стол, удержанный в брошенном диалоге
+    await release_hold(msg.from_user.id)
 
-    builder = InlineKeyboardBuilder()
-    today = datetime.today()
-    for i in range(14):
-        date = today + timedelta(days=i)
-        date_str = date.strftime("%d.%m.%Y")
-        builder.button(text=date_str, callback_data=f"date_{date_str}")
-    builder.adjust(2)
+    now = venue().now()
+    days = [now.date() + timedelta(days=i) for i in range(BOOKING_DAYS)]
+    key = ("dates", now.date(), first_slot_for(now.date(), now), tuple(availability.version(day) for day in days))
+    markup = markup_cache.get_or_build(key, lambda: dates_markup(now))
 
-    await msg.answer("Выбери дату брони:", reply_markup=builder.as_markup())
+    await msg.answer("Выбери дату брони:", reply_markup=markup)
+
+
+async def ask_guests_for_waitlist(message: Message):
+    # Свободных столов нет ни для какой компании: количество гостей нужно уже для листа ожидания
+    await message.answer(
+        "😞 На этот день свободных столов нет, но можно встать в лист ожидания.\nСколько будет гостей?",
+        reply_markup=guests_markup(dict.fromkeys(inventory.seat_classes, 1))
+    )
+
+
+@router.callback_query(F.data.startswith("full_"))
+async def full_date(callback: CallbackQuery, state: FSMContext):
+    await state.update_data(date=callback.data.replace("full_", ""))
+    await state.set_state(Booking.guests)
+    await ask_guests_for_waitlist(callback.message)
 
 
 @router.callback_query(F.data.startswith("date_"))
 async def choose_date(callback: CallbackQuery, state: FSMContext):
     date_str = callback.data.replace("date_", "")
     await state.update_data(date=date_str)
-    await state.set_state(Booking.guests)  # предположим, что дальше идёт выбор количества гостей
+    await state.set_state(Booking.guests)
 
-    # Получаем все брони на эту дату
-    existing = await get_all_bookings()
     selected_date = datetime.strptime(date_str, "%d.%m.%Y").date()
+    first_slot = first_slot_for(selected_date, venue().now())
+    markup = markup_cache.get_or_build(
+        ("guests", selected_date, availability.version(selected_date), first_slot),
+        lambda: guests_markup(free_units(selected_date, first_slot, booking_window()[1]))
+    )
 
-    # Слоты, которые надо скрыть
-    unavailable_slots = set()
-
-    for record in existing:
-        user_id, table, time_str, name, booking_at_str = record
-        booking_at = datetime.fromisoformat(booking_at_str).replace(tzinfo=None)
-
-        if booking_at.date() != selected_date:
-            continue
-
-        start = booking_at
-        end = start + timedelta(hours=2)
-
-        for hour in range(start.hour, end.hour + 1):
-            for minute in [0, 30]:
-                ts = datetime.combine(start.date(), time(hour, minute))
-                if start <= ts < end:
-                    unavailable_slots.add(ts.strftime("%H:%M"))
-
-    # Создаём кнопки только для свободного времени
-    builder = InlineKeyboardBuilder()
-    for hour in range(9, 23):  # с 9:00 до 22:30
-        for minute in [0, 30]:
-            time_str = f"{hour:02d}:{minute:02d}"
-            if time_str in unavailable_slots:
-                continue
-            builder.button(text=time_str, callback_data=f"time_{time_str}")
-
-    builder.adjust(3)
+    if not markup.inline_keyboard:
+        await ask_guests_for_waitlist(callback.message)
+        return
 
-    await callback.message.answer("Выбери время брони:", reply_markup=builder.as_markup())
+    await callback.message.answer("Сколько будет гостей?", reply_markup=markup)
 
 
 
@@ -218,18 +349,20 @@ async def choose_time(callback: CallbackQuery, state: FSMContext):
     hour, minute = map(int, time_str.split(":"))
     
     guests = data['guests']
-    date = data['date']
-    selected_dt = datetime.strptime(date, "%d.%m.%Y").replace(hour=hour, minute=minute, tzinfo=timezone.utc)
+    selected_date = datetime.strptime(data['date'], "%d.%m.%Y").date()
+    selected_slot = slot_of(hour, minute)
 
-    all_bookings = await get_all_bookings()
-    table_id, slot_time = await find_next_available_slot(guests, selected_dt, all_bookings)
+    # Стол держим за гостем, пока он вводит имя и телефон
+    table_id, slot = await hold_table(callback.from_user.id, guests, selected_date, selected_slot)
 
-    if not table_id:
-        await callback.message.answer("😞 На эту дату нет доступных столов нужной вместимости.")
+    if slot is None:
+        await callback.message.answer(
+            "😞 На эту дату нет доступных столов нужной вместимости.", reply_markup=waitlist_markup()
+        )
         return
 
-    if slot_time != selected_dt:
-        time_suggested = slot_time.astimezone(timezone(timedelta(hours=3))).strftime("%H:%M")
+    if slot != selected_slot:
+        time_suggested = slot_label(slot)
         await callback.message.answer(
             f"⚠️ Кто-то только что забронировал этот стол на это время. Попробуйте выбрать другой.\n"
             f"Ближайшее доступное время: {time_suggested}"
@@ -237,7 +370,7 @@ async def choose_time(callback: CallbackQuery, state: FSMContext):
         return
 
     # Если время свободно, сохраняем данные и запрашиваем имя
-    await state.update_data(hour=hour, minute=minute, table_number=table_id)
+    await state.update_data(hour=hour, minute=minute, table_number=table_id, waitlist=None)
     await state.set_state(Booking.name)
     await callback.message.answer("Как к вам можно обратиться?")
 
@@ -271,48 +404,113 @@ async def get_guests(callback: CallbackQuery, state: FSMContext):
     await state.set_state(Booking.time)
 
     date_str = user_data["date"]
-    selected_date = datetime.strptime(date_str, "%d.%m.%Y")
-    now = datetime.now(timezone(timedelta(hours=3)))  # МСК
-    is_today = selected_date.date() == now.date()
+    selected_date = datetime.strptime(date_str, "%d.%m.%Y").date()
+    # В часы работы заведения; сегодня — только слоты позже текущего времени
+    first_slot = first_slot_for(selected_date, venue().now())
+
+    markup = markup_cache.get_or_build(
+        ("times", selected_date, guests, availability.version(selected_date), first_slot),
+        lambda: times_markup(selected_date, guests, first_slot, booking_window()[1])
+    )
 
-    all_bookings = await get_all_bookings()
-    blocked_slots = set()
+    if not markup.inline_keyboard:
+        await callback.message.answer(
+            "😞 К сожалению, на выбранную дату нет свободных слотов.\n"
+            "Попробуйте выбрать другой день или встаньте в лист ожидания — напишем, как только стол освободится.",
+            reply_markup=waitlist_markup()
+        )
+        await state.set_state(Booking.date)
+        return
 
-    if guests == 8:
-        for user_id, table, time, name, booking_at_str in all_bookings:
-            booking_at = datetime.fromisoformat(booking_at_str).replace(tzinfo=timezone.utc)
-            booking_at_local = booking_at.astimezone(timezone(timedelta(hours=3)))
+    await callback.message.answer("Выбери время бронирования:", reply_markup=markup)
 
-            if booking_at_local.date() != selected_date.date():
-                continue
 
-            if int(table) == 8:  # бронь на 8 гостей
-                for shift_minutes in range(-119, 120, 30):
-                    blocked = (booking_at_local + timedelta(minutes=shift_minutes)).strftime("%H:%M")
-                    blocked_slots.add(blocked)
+@router.callback_query(F.data == "waitlist")
+async def join_waitlist(callback: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    if "guests" not in data or "date" not in data:
+        await callback.message.answer("⚠️ Пожалуйста, начните бронирование заново: выбери дату и количество гостей.")
+        await state.set_state(Booking.date)
+        return
 
     builder = InlineKeyboardBuilder()
-    for hour in range(9, 24):
-        for minute in [0, 30]:
-            slot_time = selected_date.replace(hour=hour, minute=minute, tzinfo=timezone(timedelta(hours=3)))
+    for label, first_slot, last_slot in waitlist_windows():
+        builder.button(text=label, callback_data=f"waitlist_{first_slot}_{last_slot}")
+    builder.adjust(1)
+    await callback.message.answer("В какое время вам было бы удобно прийти?", reply_markup=builder.as_markup())
+
+
+@router.callback_query(F.data.startswith("waitlist_"))
+async def choose_waitlist_window(callback: CallbackQuery, state: FSMContext):
+    _, first_slot, last_slot = callback.data.split("_")
+    # Дальше — те же шаги с именем и телефоном, что и у обычной брони; get_phone увидит флаг waitlist
+    await state.update_data(waitlist=[int(first_slot), int(last_slot)])
+    await state.set_state(Booking.name)
+    await callback.message.answer("Как к вам можно обратиться?")
 
-            if is_today and slot_time <= now:
-                continue
 
-            time_str = f"{hour:02d}:{minute:02d}"
-            if time_str in blocked_slots:
-                continue  # ⛔️ Пропускаем заблокированное время
+async def register_waitlist(msg: Message, state: FSMContext, data: dict):
+    first_slot, last_slot = data["waitlist"]
+    day = datetime.strptime(data["date"], "%d.%m.%Y").date()
+    await add_to_waitlist(
+        msg.from_user.id, day.isoformat(), first_slot, last_slot, data["guests"], data["name"], data["phone"]
+    )
+    await end_dialog(state)
+    await msg.answer(
+        f"📝 Вы в листе ожидания на {data['date']}, {slot_label(first_slot)}–{slot_label(last_slot)}, "
+        f"гостей: {data['guests']}.\n"
+        f"Как только освободится стол, пришлём предложение — на ответ будет "
+        f"{int(OFFER_TTL.total_seconds()) // 60} минут."
+    )
 
-            builder.button(text=time_str, callback_data=f"time_{time_str}")
 
-    builder.adjust(3)
+@router.callback_query(F.data.startswith("wl_accept_"))
+async def accept_waitlist_offer(callback: CallbackQuery):
+    # Предложение пришло от заведения, а не из диалога: заведение берётся из кнопки
+    _, _, entry_id, *rest = callback.data.split("_")
+    with use_venue(callback_venue(rest)):
+        await accept_offer(callback, int(entry_id))
 
-    if not builder.buttons:
-        await callback.message.answer("😞 К сожалению, на выбранную дату нет свободных слотов.\nПопробуйте выбрать другой день.")
-        await state.set_state(Booking.date)
+
+async def accept_offer(callback: CallbackQuery, entry_id: int):
+    entry = await get_waitlist_entry(entry_id, callback.from_user.id)
+    if entry is None or entry.offer_table is None or entry.offer_expires_at <= time.time():
+        await callback.message.answer("⌛ Это предложение уже недоступно.")
+        return
+
+    start = datetime.fromtimestamp(entry.offer_start_ts, venue().tz)
+    date_str, time_str = start.strftime("%d.%m.%Y"), start.strftime("%H:%M")
+    text = new_booking_alert(date_str, time_str, entry.guests, entry.name, entry.phone)
+    # Холд на стол поставлен вместе с предложением; заявка снимается в одной транзакции с бронью
+    try:
+        await save_booking(
+            user_id=entry.user_id,
+            table_number=entry.offer_table,
+            guests=entry.guests,
+            time=time_str,
+            name=entry.name,
+            date=date_str,
+            compose_messages=lambda bookings: [(venue().manager_chat_id, text)] if starts_soon(bookings[0]) else [],
+            conflicts=inventory.conflicts(entry.offer_table),
+            phone=entry.phone,
+            waitlist_id=entry.id,
+        )
+    except ValueError:
+        await callback.message.answer("😞 К сожалению, этот стол уже заняли.")
         return
 
-    await callback.message.answer("Выбери время бронирования:", reply_markup=builder.as_markup())
+    await media.answer_photo(
+        callback.message, IMG_PATH, caption=confirmation_caption(date_str, time_str, entry.guests, entry.name)
+    )
+
+
+@router.callback_query(F.data.startswith("wl_decline_"))
+async def decline_waitlist_offer(callback: CallbackQuery):
+    _, _, entry_id, *rest = callback.data.split("_")
+    with use_venue(callback_venue(rest)):
+        # Холд предложения снимается вместе с заявкой — стол сразу достанется следующему
+        await delete_waitlist_entries([int(entry_id)], user_id=callback.from_user.id)
+    await callback.message.answer("Хорошо, заявка из листа ожидания снята.")
 
 
 @router.message(Booking.phone)
@@ -321,32 +519,36 @@ async def get_phone(msg: Message, state: FSMContext):
     await state.update_data(phone=phone)
 
     data = await state.get_data()
-    time_str = f"{data['hour']:02d}:{data['minute']:02d}"
-
-    # Удалена проверка доступности, так как она уже выполнена в choose_time
-    await save_booking(
-        user_id=msg.from_user.id,
-        table_number=str(data["guests"]),
-        time=time_str,
-        name=data["name"],
-        date=data["date"]
-    )
+    if data.get("waitlist"):
+        await register_waitlist(msg, state, data)
+        return
 
-    await msg.answer(
-        f"Спасибо {str(data['name']).capitalize()}! Ваше бронирование на {data['guests']} гостей, {data['date']}, в {time_str}.\n"
-        f"Отличный отдых теперь гарантирован! Хотим сообщить что длительность бронирования составляет 2 часа, "
-        f"если у нас будет возможность мы с радостью продлим это время 🤍"
-    )
+    time_str = f"{data['hour']:02d}:{data['minute']:02d}"
+    text = new_booking_alert(data["date"], time_str, data["guests"], data["name"], phone)
+
+    # Стол удерживается с choose_time, а save_booking атомарно перепроверяет его на случай истёкшего холда
+    try:
+        await save_booking(
+            user_id=msg.from_user.id,
+            table_number=data["table_number"],
+            guests=data["guests"],
+            time=time_str,
+            name=data["name"],
+            date=data["date"],
+            # Отдельным сообщением — только скорые брони, остальные попадут в расписание дня
+            compose_messages=lambda bookings: [(venue().manager_chat_id, text)] if starts_soon(bookings[0]) else [],
+            conflicts=inventory.conflicts(data["table_number"]),
+            phone=phone,
+        )
+    except ValueError:
+        await msg.answer("😞 Пока вы заполняли данные, это время успели занять. Пожалуйста, выберите другое время.")
+        await state.set_state(Booking.time)
+        return
 
-    manager_chat_id = -4980377325
-    text = (
-        f"📢 Новая бронь!\n"
-        f"📅 Дата: {data['date']}\n"
-        f"⏰ Время: {time_str}\n"
-        f"👥 Кол-во гостей: {data['guests']}\n"
-        f"👤 Имя: {str(data['name']).capitalize()}\n"
-        f"📞 Телефон: {phone}"
+    # Диалог закончен: без состояния гость снова делит общий лимит апдейтов с остальными
+    await end_dialog(state)
+    await media.answer_photo(
+        msg, IMG_PATH, caption=confirmation_caption(data["date"], time_str, data["guests"], data["name"])
     )
-    await msg.bot.send_message(chat_id=manager_chat_id, text=text)
 
 
@@ -0,0 +1,89 @@
+import csv
+import os
+import tempfile
+from datetime import timedelta
+
+from aiogram import Router, F
+from aiogram.filters import Command, CommandObject
+from aiogram.types import Message, FSInputFile
+
+from db import EXPORT_COLUMNS, iter_export_rows, occupancy_report
+from availability import BOOKING_SLOTS, SLOT_MINUTES
+from handlers.form import booking_window, last_seating_slot
+from venues import venue, venue_by_chat
+
+
+# Команды менеджеров работают только в их чатах; VenueMiddleware уже выбрал заведение чата
+router = Router()
+router.message.filter(F.chat.id.func(lambda chat_id: venue_by_chat(chat_id) is not None))
+
+REPORT_DAYS = 30
+MAX_REPORT_DAYS = 366
+
+
+def open_seconds() -> int:
+    # Зал открыт с первого слота до конца последней брони — это 100% загрузки стола
+    return (last_seating_slot() + BOOKING_SLOTS - booking_window()[0]) * SLOT_MINUTES * 60
+
+
+@router.message(Command("export"))
+async def export_bookings(msg: Message):
+    # Строки пишутся во временный файл по мере чтения курсора — память не растёт с архивом
+    rows = 0
+    with tempfile.NamedTemporaryFile(
+        "w", suffix=".csv", newline="", encoding="utf-8-sig", delete=False
+    ) as file:
+        path = file.name
+        writer = csv.writer(file)
+        writer.writerow(EXPORT_COLUMNS)
+        async for row in iter_export_rows():
+            writer.writerow(row)
+            rows += 1
+    try:
+        filename = f"bookings_{venue().id}_{venue().now().strftime('%Y-%m-%d')}.csv"
+        await msg.answer_document(FSInputFile(path, filename=filename), caption=f"📤 Броней в выгрузке: {rows}")
+    finally:
+        os.unlink(path)
+
+
+def render_report(report: dict, first_day, days: int) -> str:
+    lines = [f"📊 {venue().name}: загрузка с {first_day.strftime('%d.%m.%Y')} за {days} дн."]
+
+    lines.append("\n👥 Гостей по дням:")
+    for day, bookings, covers in report["covers"]:
+        lines.append(f"  {day[8:10]}.{day[5:7]} — {covers} чел., {bookings} брон.")
+    if not report["covers"]:
+        lines.append("  броней не было")
+
+    lines.append("\n🪑 Загрузка столов:")
+    for table, bookings, percent in report["utilization"]:
+        lines.append(f"  {table} — {percent}% ({bookings} брон.)")
+
+    lines.append("\n⏰ Пиковые получасы:")
+    for half_hour, tables, covers in report["peaks"]:
+        lines.append(f"  {half_hour} — столов {tables}, гостей {covers}")
+
+    lines.append(
+        f"\n❌ Отмен: {report['cancelled']} из {report['bookings']} ({report['cancellation_rate']}%)"
+    )
+    return "\n".join(lines)
+
+
+@router.message(Command("report"))
+async def report(msg: Message, command: CommandObject):
+    # /report 7 — за последние 7 дней, включая сегодня; без аргумента — за REPORT_DAYS
+    days = REPORT_DAYS
+    if command.args:
+        if not command.args.strip().isdigit():
+            await msg.answer("Использование: /report [дней]")
+            return
+        days = min(max(int(command.args), 1), MAX_REPORT_DAYS)
+
+    today = venue().now().replace(hour=0, minute=0, second=0, microsecond=0)
+    start = today - timedelta(days=days - 1)
+    end = today + timedelta(days=1)
+    data = await occupancy_report(int(start.timestamp()), int(end.timestamp()), open_seconds())
+    text = render_report(data, start, days)
+    if len(text) > 4096:
+        text = text[:4095] + "…"
+    await msg.answer(text)
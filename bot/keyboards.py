@@ -0,0 +1,48 @@
+import time
+from collections import OrderedDict
+from datetime import date
+from typing import Callable, Hashable
+
+from aiogram.types import InlineKeyboardMarkup
+
+from venues import VenueLocal, venue
+
+
+CACHE_SIZE = 512
+CACHE_TTL = 15 * 60
+
+
+class MarkupCache:
+    """LRU-кэш готовых inline-клавиатур с TTL; целиком сбрасывается в полночь по времени заведения."""
+
+    def __init__(self, maxsize: int = CACHE_SIZE, ttl: float = CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items: OrderedDict[Hashable, tuple[float, InlineKeyboardMarkup]] = OrderedDict()
+        self._day: date | None = None
+
+    def clear(self):
+        self._items.clear()
+
+    def get_or_build(self, key: Hashable, build: Callable[[], InlineKeyboardMarkup]) -> InlineKeyboardMarkup:
+        today = venue().now().date()
+        if today != self._day:
+            self._items.clear()
+            self._day = today
+
+        now = time.monotonic()
+        item = self._items.get(key)
+        if item is not None and item[0] > now:
+            self._items.move_to_end(key)
+            return item[1]
+
+        markup = build()
+        self._items[key] = (now + self.ttl, markup)
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+        return markup
+
+
+# Клавиатуры строятся по занятости конкретного заведения
+markup_cache = VenueLocal(MarkupCache)
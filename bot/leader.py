@@ -0,0 +1,102 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Awaitable, Callable
+
+from db import Fence, acquire_lease, release_lease
+from metrics import is_leader
+from venues import venue
+
+
+LEASE_NAME = "background_jobs"
+LEASE_TTL = 10.0
+# Продлеваем заметно чаще, чем истекает аренда: пара пропущенных продлений не сбросит лидера
+RENEW_INTERVAL = 3.0
+
+
+class LeaderElection:
+    """Аренда лидерства в общей БД: фоновые задачи крутит только экземпляр, который её держит.
+
+    Аренда лежит в базе заведения, в контексте которого запущен run(): у каждого заведения
+    свой лидер, и фоновые задачи разных заведений могут крутиться на разных экземплярах.
+
+    Лидер продлевает аренду каждые RENEW_INTERVAL секунд. Если он упал, аренда истекает
+    через LEASE_TTL, и её забирает первый из резервных экземпляров. При каждой смене
+    владельца растёт fencing token: записи фоновых задач сверяют его в своей транзакции,
+    так что отставший бывший лидер ничего не испортит.
+    """
+
+    def __init__(
+        self,
+        on_elected: Callable[[], Awaitable[None]],
+        on_lost: Callable[[], Awaitable[None]],
+        name: str = LEASE_NAME,
+        ttl: float = LEASE_TTL,
+        renew_interval: float = RENEW_INTERVAL,
+    ):
+        self.on_elected = on_elected
+        self.on_lost = on_lost
+        self.name = name
+        self.ttl = ttl
+        self.renew_interval = renew_interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.token: int | None = None
+        self._valid_until = 0.0
+
+    @property
+    def fence(self) -> Fence | None:
+        return (self.name, self.token) if self.token is not None else None
+
+    async def _step_down(self):
+        logging.info("Экземпляр %s больше не лидер в %s", self.owner, venue().id)
+        self.token = None
+        is_leader.set(0, venue=venue().id)
+        await self.on_lost()
+
+    async def _tick(self):
+        started = time.monotonic()
+        try:
+            token = await acquire_lease(self.name, self.owner, self.ttl)
+        except Exception:
+            logging.exception("Не удалось продлить аренду лидерства")
+            # Не смогли достучаться до БД — держимся, пока аренда точно наша
+            if self.token is not None and time.monotonic() >= self._valid_until:
+                await self._step_down()
+            return
+
+        if self.token is not None and token != self.token:
+            await self._step_down()
+        if token is not None and self.token is None:
+            self.token = token
+            logging.info("Экземпляр %s стал лидером в %s, token=%s", self.owner, venue().id, token)
+            is_leader.set(1, venue=venue().id)
+            try:
+                await self.on_elected()
+            except Exception:
+                logging.exception("Не удалось запустить фоновые задачи лидера")
+                await self._step_down()
+                await release_lease(self.name, self.owner)
+                return
+        if token is not None:
+            # Отсчёт от начала запроса: аренда могла быть записана в самом его начале
+            self._valid_until = started + self.ttl
+
+    async def run(self):
+        try:
+            while True:
+                try:
+                    await self._tick()
+                except Exception:
+                    logging.exception("Ошибка в выборах лидера")
+                await asyncio.sleep(self.renew_interval)
+        finally:
+            if self.token is not None:
+                await self._step_down()
+                # Отдаём аренду сразу, чтобы резервный экземпляр не ждал её истечения
+                try:
+                    await release_lease(self.name, self.owner)
+                except Exception:
+                    logging.exception("Не удалось освободить аренду лидерства")
@@ -1,8 +1,21 @@
 import asyncio
 from aiogram import Bot, Dispatcher
 from bot_core import router
-from db import init_db, reminder_loop, migrate_add_notification_flags
+from db import init_db, open_db, close_db, watch_versions
 from sheduler_time import setup_scheduler
+from availability import load_availability
+from allocation import load_inventory
+from reminders import ReminderScheduler
+from outbox import Outbox
+from metrics import start_metrics_server
+from config import config
+from fsm_storage import SQLiteStorage
+from middlewares.fsm_buffer import FSMBufferMiddleware
+from webhook import run_webhook
+from leader import LeaderElection
+from dashboard import Dashboard
+from waitlist import WaitlistMatcher
+from venues import Venue, all_venues, load_venues, use_venue
 
 import os
 import logging
@@ -18,16 +31,71 @@ async def main():
         level=logging.INFO,
         format="%(asctime)s - %(levelname)s - %(name)s - %(message)s",
     )
+    load_venues(config.venues_path)
+    await open_db(fsm_path=config.fsm_db_path)
     await init_db()
-    await migrate_add_notification_flags()
     bot = Bot(TOKEN)
-    dp = Dispatcher()
+    # Диалоги общие для всех заведений и живут в своей базе (config.fsm_db_path)
+    storage = SQLiteStorage(ttl=config.fsm_ttl_hours * 3600)
+    dp = Dispatcher(storage=storage)
+    FSMBufferMiddleware(storage).setup(dp)
     dp.include_router(router)
 
-    setup_scheduler(bot)
-    asyncio.create_task(reminder_loop(bot))
+    # Задачи наследуют контекст, в котором созданы: всё, что запущено внутри use_venue,
+    # работает с базой, столами и подписками своего заведения
+    background = []
+    for venue in all_venues():
+        with use_venue(venue.id):
+            load_inventory()
+            await load_availability()
+            background.append(asyncio.create_task(watch_versions()))
+            background.append(asyncio.create_task(venue_leader(bot, venue).run()))
 
-    await dp.start_polling(bot)
+    metrics_runner = None
+    if config.metrics_port:
+        metrics_runner = await start_metrics_server(config.metrics_host, config.metrics_port)
+
+    try:
+        if config.mode == "webhook":
+            await run_webhook(dp, bot, config)
+        else:
+            await dp.start_polling(bot)
+    finally:
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        await storage.close()
+        await close_db()
+
+
+def venue_leader(bot: Bot, venue: Venue) -> LeaderElection:
+    # Экземпляров бота может быть несколько: хендлеры работают на всех,
+    # а рассылки и уборку завершённых броней заведения ведёт только его лидер
+    jobs = {}
+
+    async def start_jobs():
+        reminders = ReminderScheduler(fence=lambda: leader.fence)
+        await reminders.load()
+        jobs["scheduler"] = setup_scheduler(fence=lambda: leader.fence)
+        jobs["tasks"] = [
+            asyncio.create_task(reminders.run()),
+            asyncio.create_task(Outbox(bot).run()),
+            asyncio.create_task(Dashboard(bot, venue.manager_chat_id).run()),
+            asyncio.create_task(WaitlistMatcher(fence=lambda: leader.fence).run()),
+        ]
+
+    async def stop_jobs():
+        if "scheduler" in jobs:
+            jobs.pop("scheduler").shutdown(wait=False)
+        tasks = jobs.pop("tasks", [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    leader = LeaderElection(on_elected=start_jobs, on_lost=stop_jobs)
+    return leader
 
 if __name__ == "__main__":
     asyncio.run(main())
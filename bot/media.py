@@ -0,0 +1,85 @@
+import asyncio
+import hashlib
+import logging
+from pathlib import Path
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, Message
+
+from db import get_media_file_id, save_media_file_id, delete_media_file_id
+from metrics import media_sends
+
+
+class MediaCache:
+    """Картинки из файлов бота: на сервер Telegram каждая загружается один раз.
+
+    Полученный file_id хранится в media_files по sha256 содержимого, поэтому после
+    правки файла его хэш, а с ним и ключ, меняются — новая версия загрузится сама.
+    Хэш пересчитывается, только если у файла поменялись размер или mtime.
+    """
+
+    def __init__(self):
+        # путь -> ((mtime_ns, size), sha256)
+        self._hashes: dict[Path, tuple[tuple[int, int], str]] = {}
+        self._file_ids: dict[str, str] = {}
+        # Параллельные /start сразу после запуска не должны загружать одну картинку каждый
+        self._upload_locks: dict[str, asyncio.Lock] = {}
+
+    async def _content_hash(self, path: Path) -> str:
+        stat = path.stat()
+        signature = (stat.st_mtime_ns, stat.st_size)
+        cached = self._hashes.get(path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        digest = await asyncio.to_thread(lambda: hashlib.sha256(path.read_bytes()).hexdigest())
+        self._hashes[path] = (signature, digest)
+        return digest
+
+    async def _file_id(self, content_hash: str) -> str | None:
+        file_id = self._file_ids.get(content_hash)
+        if file_id is None:
+            file_id = await get_media_file_id(content_hash)
+            if file_id is not None:
+                self._file_ids[content_hash] = file_id
+        return file_id
+
+    async def _forget(self, content_hash: str):
+        self._file_ids.pop(content_hash, None)
+        await delete_media_file_id(content_hash)
+
+    async def answer_photo(self, message: Message, path: Path, **kwargs) -> Message:
+        """message.answer_photo по файлу с диска, но без повторной загрузки уже известной картинки."""
+        path = Path(path)
+        content_hash = await self._content_hash(path)
+
+        file_id = await self._file_id(content_hash)
+        if file_id is not None:
+            try:
+                sent = await message.answer_photo(file_id, **kwargs)
+                media_sends.inc(source="cache")
+                return sent
+            except TelegramBadRequest as e:
+                # file_id привязан к токену бота: после смены токена старые id не работают
+                if "file" not in str(e).lower():
+                    raise
+                logging.warning("Telegram не принял сохранённый file_id для %s: %s", path.name, e)
+                await self._forget(content_hash)
+
+        lock = self._upload_locks.setdefault(content_hash, asyncio.Lock())
+        async with lock:
+            file_id = self._file_ids.get(content_hash)
+            if file_id is not None:
+                media_sends.inc(source="cache")
+                return await message.answer_photo(file_id, **kwargs)
+
+            sent = await message.answer_photo(FSInputFile(path), **kwargs)
+            media_sends.inc(source="upload")
+            if sent.photo:
+                # Самый большой размер — тот, что загрузили; остальные Telegram сделал превью
+                file_id = sent.photo[-1].file_id
+                self._file_ids[content_hash] = file_id
+                await save_media_file_id(content_hash, file_id)
+            return sent
+
+
+media = MediaCache()
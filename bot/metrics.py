@@ -0,0 +1,176 @@
+import functools
+import logging
+import time
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable
+
+from aiohttp import web
+
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key: tuple, extra: tuple = ()) -> str:
+    items = key + extra
+    if not items:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in items) + "}"
+
+
+class Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        registry.append(self)
+
+    @abstractmethod
+    def samples(self):
+        """(имя серии, метки, значение) для каждой серии метрики."""
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for name, key, value in self.samples():
+            lines.append(f"{name}{key} {value}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _labels_key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_labels_key(labels), 0)
+
+    def samples(self):
+        for key, value in self._values.items():
+            yield self.name, _format_labels(key), value
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self._values: dict[tuple, float] = {}
+
+    def set(self, value: float, **labels):
+        self._values[_labels_key(labels)] = value
+
+    def samples(self):
+        for key, value in self._values.items():
+            yield self.name, _format_labels(key), value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(buckets)
+        # На каждый набор меток: [счётчики по корзинам..., сумма, количество]
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = _labels_key(labels)
+        series = self._values.get(key)
+        if series is None:
+            series = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+                break
+        series[-2] += value
+        series[-1] += 1
+
+    def samples(self):
+        for key, series in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                yield f"{self.name}_bucket", _format_labels(key, (("le", bound),)), cumulative
+            yield f"{self.name}_bucket", _format_labels(key, (("le", "+Inf"),)), series[-1]
+            yield f"{self.name}_sum", _format_labels(key), series[-2]
+            yield f"{self.name}_count", _format_labels(key), series[-1]
+
+
+registry: list[Metric] = []
+# Асинхронные сборщики вызываются перед каждой выдачей метрик (например, размер outbox из БД)
+collectors: list[Callable[[], Awaitable[None]]] = []
+
+
+handler_latency = Histogram("bot_handler_latency_seconds", "Время обработки апдейта хендлером")
+handler_errors = Counter("bot_handler_errors_total", "Исключения в хендлерах")
+db_latency = Histogram("bot_db_query_seconds", "Время выполнения функций db.py")
+db_errors = Counter("bot_db_query_errors_total", "Исключения в функциях db.py")
+reminder_lag = Gauge("bot_reminder_lag_seconds", "Насколько позже дедлайна ушла последняя пачка напоминаний")
+expiry_batch = Gauge("bot_expiry_batch_size", "Сколько броней перенесено в архив последним запуском")
+outbox_depth = Gauge("bot_outbox_queue_depth", "Сообщений в очереди outbox")
+throttled_updates = Counter("bot_throttled_updates_total", "Апдейты, отброшенные лимитами (scope=user|global|dialog)")
+throttled_users = Gauge("bot_throttled_users_tracked", "Пользователей с неполным ведром токенов в памяти")
+callback_duplicates = Counter("bot_callback_duplicates_total", "Повторные нажатия кнопок, отброшенные без выполнения")
+is_leader = Gauge("bot_is_leader", "1, если этот экземпляр держит аренду фоновых задач")
+webhook_queue = Gauge("bot_webhook_queue_depth", "Принятых через webhook апдейтов, ждущих обработки")
+media_sends = Counter("bot_media_sends_total", "Отправки картинок (source=cache|upload)")
+waitlist_size = Gauge("bot_waitlist_entries", "Заявок в листе ожидания на сегодня и позже")
+waitlist_offers = Counter("bot_waitlist_offers_total", "Предложения освободившихся столов из листа ожидания (result=sent|expired)")
+
+
+def timed(func):
+    """Замеряет время и ошибки асинхронной функции db.py под её именем."""
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            db_errors.inc(query=name)
+            raise
+        finally:
+            db_latency.observe(time.perf_counter() - started, query=name)
+
+    return wrapper
+
+
+async def render() -> str:
+    for collect in collectors:
+        try:
+            await collect()
+        except Exception:
+            logging.exception("Ошибка при сборе метрик")
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+async def _metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(text=await render(), content_type="text/plain", charset="utf-8")
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    app = web.Application()
+    app.router.add_get("/metrics", _metrics_handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info("Метрики доступны на http://%s:%s/metrics", host, port)
+    return runner
@@ -0,0 +1,32 @@
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.types import TelegramObject
+
+from fsm_storage import SQLiteStorage
+
+
+class FSMBufferMiddleware(BaseMiddleware):
+    """Внешний middleware апдейта: диалог читается из базы один раз и пишется одним запросом.
+
+    Всё, что хендлер и остальные middleware делают с FSMContext за апдейт, копится
+    в SQLiteStorage.buffered и уходит в базу, когда хендлер вернул управление.
+    """
+
+    def __init__(self, storage: SQLiteStorage):
+        self.storage = storage
+
+    def setup(self, dp: Dispatcher):
+        # FSMContextMiddleware читает raw_state ещё до хендлера — буфер должен открыться раньше него
+        dp.update.outer_middleware.unregister(dp.fsm)
+        dp.update.outer_middleware(self)
+        dp.update.outer_middleware(dp.fsm)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        async with self.storage.buffered():
+            return await handler(event, data)
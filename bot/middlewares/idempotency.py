@@ -0,0 +1,91 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import CallbackQuery
+
+from metrics import callback_duplicates
+
+
+DUPLICATE_WINDOW = 3.0
+CACHE_SIZE = 10_000
+
+
+class IdempotencyMiddleware(BaseMiddleware):
+    """Повторные нажатия одной и той же кнопки выполняются один раз.
+
+    Ключ — (пользователь, callback data, сообщение с кнопкой). Пока первое нажатие
+    обрабатывается, повторы ждут его и получают тот же результат; ещё `window` секунд
+    после — отбрасываются сразу. На callback query отвечаем до хендлера, чтобы у кнопки
+    не висели часики; хендлеры с флагом answer_callback=False отвечают сами.
+    """
+
+    def __init__(self, window: float = DUPLICATE_WINDOW, maxsize: int = CACHE_SIZE):
+        self.window = window
+        self.maxsize = maxsize
+        self._done: OrderedDict[Hashable, float] = OrderedDict()
+        self._inflight: dict[Hashable, asyncio.Future] = {}
+
+    def _key(self, event: CallbackQuery) -> Hashable:
+        message_id = event.message.message_id if event.message else event.inline_message_id
+        return event.from_user.id, event.data, message_id
+
+    def _seen_recently(self, key: Hashable, now: float) -> bool:
+        # Окно у всех одинаковое, поэтому записи упорядочены по сроку — старые лежат в начале
+        while self._done:
+            _, expires_at = next(iter(self._done.items()))
+            if expires_at > now:
+                break
+            self._done.popitem(last=False)
+        return key in self._done
+
+    def _remember(self, key: Hashable):
+        self._done[key] = time.monotonic() + self.window
+        self._done.move_to_end(key)
+        while len(self._done) > self.maxsize:
+            self._done.popitem(last=False)
+
+    async def _answer(self, event: CallbackQuery):
+        try:
+            await event.answer()
+        except TelegramBadRequest as e:
+            # Например, query устарел, пока апдейт стоял в очереди — кнопка всё равно сработает
+            logging.debug("Не удалось ответить на callback %s: %s", event.id, e)
+
+    async def __call__(
+        self,
+        handler: Callable[[CallbackQuery, dict[str, Any]], Awaitable[Any]],
+        event: CallbackQuery,
+        data: dict[str, Any],
+    ) -> Any:
+        key = self._key(event)
+        answers_itself = get_flag(data, "answer_callback", default=True) is False
+
+        inflight = self._inflight.get(key)
+        if inflight is not None or self._seen_recently(key, time.monotonic()):
+            callback_duplicates.inc(handler=data["handler"].callback.__name__)
+            await self._answer(event)
+            if inflight is not None:
+                return await asyncio.shield(inflight)
+            return None
+
+        future = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            if not answers_itself:
+                await self._answer(event)
+            result = await handler(event, data)
+        except BaseException:
+            # Ошибку покажет только исходный апдейт; повтор нажатия после неё снова выполнится
+            future.set_result(None)
+            raise
+        else:
+            future.set_result(result)
+            self._remember(key)
+            return result
+        finally:
+            del self._inflight[key]
@@ -0,0 +1,46 @@
+import time
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from metrics import handler_latency, handler_errors
+
+
+class HandlerNameMiddleware(BaseMiddleware):
+    """Внутренний middleware: к этому моменту хендлер уже выбран, запоминаем его имя."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        labels = data.get("metrics_labels")
+        if labels is not None:
+            labels["handler"] = data["handler"].callback.__name__
+        return await handler(event, data)
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Внешний middleware: время обработки и ошибки по каждому хендлеру."""
+
+    def __init__(self, event_type: str):
+        self.event_type = event_type
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        # Словарь общий для всей цепочки: имя хендлера допишет HandlerNameMiddleware
+        labels = data["metrics_labels"] = {"handler": "unhandled"}
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc(event=self.event_type, handler=labels["handler"])
+            raise
+        finally:
+            handler_latency.observe(time.perf_counter() - started, event=self.event_type, handler=labels["handler"])
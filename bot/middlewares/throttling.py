@@ -0,0 +1,125 @@
+import logging
+import time
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import CallbackQuery, TelegramObject
+
+from metrics import throttled_updates, throttled_users
+
+
+# Гостю хватает пары действий в секунду; короткая очередь нажатий проходит за счёт запаса
+USER_RATE, USER_BURST = 2.0, 8
+# Общий поток апдейтов, который бот переваривает без роста задержек
+GLOBAL_RATE, GLOBAL_BURST = 150.0, 300
+# Отдельный, меньший запас для гостей посреди диалога бронирования
+DIALOG_RATE, DIALOG_BURST = 50.0, 100
+EVICT_INTERVAL = 60
+# Не чаще раза в WARN_INTERVAL секунд говорим пользователю, что он упёрся в лимит
+WARN_INTERVAL = 30
+THROTTLED_TEXT = "⏳ Слишком много запросов, подождите несколько секунд."
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, now: float) -> bool:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Внешний middleware: ведро токенов на каждого пользователя и одно общее.
+
+    Ведро пользователя — список [токены, время обновления, время предупреждения]; ведро,
+    которое успело наполниться, ничем не отличается от отсутствующего, поэтому такие
+    раз в EVICT_INTERVAL выкидываются. Гости посреди диалога бронирования берут токены
+    не из общего ведра, а из своего, поменьше: при наплыве новых апдейтов отсекаются
+    те, а не гости, которые уже выбирают время. Состояние диалога гость заводит себе
+    сам одной кнопкой, поэтому полного освобождения от лимита оно не даёт — аккаунты,
+    зависшие в диалоге, упрутся в DIALOG_RATE.
+    """
+
+    def __init__(
+        self,
+        user_rate: float = USER_RATE,
+        user_burst: float = USER_BURST,
+        global_rate: float = GLOBAL_RATE,
+        global_burst: float = GLOBAL_BURST,
+        dialog_rate: float = DIALOG_RATE,
+        dialog_burst: float = DIALOG_BURST,
+    ):
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.dialog_bucket = TokenBucket(dialog_rate, dialog_burst)
+        self._users: dict[int, list] = {}
+        self._last_evict = time.monotonic()
+
+    def _evict_idle(self, now: float):
+        self._last_evict = now
+        refill_time = self.user_burst / self.user_rate
+        for user_id in [u for u, bucket in self._users.items() if now - bucket[1] >= refill_time]:
+            del self._users[user_id]
+        throttled_users.set(len(self._users))
+
+    def _take_user(self, user_id: int, now: float) -> list | None:
+        """Списывает токен пользователя; при отказе возвращает его ведро."""
+        bucket = self._users.get(user_id)
+        if bucket is None:
+            self._users[user_id] = [self.user_burst - 1, now, 0.0]
+            return None
+        bucket[0] = min(self.user_burst, bucket[0] + (now - bucket[1]) * self.user_rate)
+        bucket[1] = now
+        if bucket[0] < 1:
+            return bucket
+        bucket[0] -= 1
+        return None
+
+    async def _reply_throttled(self, event: TelegramObject):
+        # У Message это новое сообщение, у CallbackQuery — всплывающая подсказка
+        try:
+            await event.answer(THROTTLED_TEXT)
+        except TelegramAPIError as e:
+            logging.debug("Не удалось предупредить о лимите: %s", e)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        event_type = "callback_query" if isinstance(event, CallbackQuery) else "message"
+        now = time.monotonic()
+        if now - self._last_evict > EVICT_INTERVAL:
+            self._evict_idle(now)
+
+        bucket = self._take_user(user.id, now)
+        if bucket is not None:
+            throttled_updates.inc(event=event_type, scope="user")
+            # Ответ на каждый отброшенный апдейт сам стал бы флудом
+            if now - bucket[2] > WARN_INTERVAL:
+                bucket[2] = now
+                await self._reply_throttled(event)
+            return None
+
+        in_dialog = data.get("raw_state") is not None
+        if not (self.dialog_bucket if in_dialog else self.global_bucket).take(now):
+            # Перегрузка: молча отбрасываем, чтобы не тратить на ответ ещё и вызовы API
+            throttled_updates.inc(event=event_type, scope="dialog" if in_dialog else "global")
+            return None
+
+        return await handler(event, data)
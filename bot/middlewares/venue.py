@@ -0,0 +1,32 @@
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.fsm.context import FSMContext
+from aiogram.types import TelegramObject
+
+from venues import default_venue, get_venue, use_venue, venue_by_chat
+
+
+class VenueMiddleware(BaseMiddleware):
+    """Внешний middleware: хендлер выполняется в контексте заведения (venues.use_venue).
+
+    Чат менеджеров однозначно указывает на своё заведение; гость выбирает заведение
+    в /start, и оно хранится в данных диалога под ключом "venue". Без выбора —
+    заведение по умолчанию. Кнопки, пришедшие не из диалога (отмена брони, предложение
+    из листа ожидания), сами несут id заведения, и их хендлеры переключают его явно.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        chat = data.get("event_chat")
+        selected = venue_by_chat(chat.id) if chat is not None else None
+        if selected is None:
+            state: FSMContext | None = data.get("state")
+            venue_id = (await state.get_data()).get("venue") if state is not None else None
+            selected = get_venue(venue_id) if venue_id else None
+        with use_venue((selected or default_venue()).id):
+            return await handler(event, data)
@@ -0,0 +1,303 @@
+import logging
+
+import aiosqlite
+
+
+BOOKING_DURATION_SECONDS = 2 * 60 * 60
+
+
+async def _columns(db: aiosqlite.Connection, table: str) -> set[str]:
+    rows = await db.execute_fetchall(f"PRAGMA table_info({table})")
+    return {row[1] for row in rows}
+
+
+async def create_bookings(db: aiosqlite.Connection):
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS bookings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            table_number TEXT NOT NULL,
+            time TEXT NOT NULL,
+            name TEXT NOT NULL,
+            booking_at TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+
+
+async def add_notification_flags(db: aiosqlite.Connection):
+    # В старых базах колонки добавлялись без учёта версии схемы
+    columns = await _columns(db, "bookings")
+    if "notify_24_sent" not in columns:
+        await db.execute("ALTER TABLE bookings ADD COLUMN notify_24_sent BOOLEAN DEFAULT 0")
+    if "notify_12_sent" not in columns:
+        await db.execute("ALTER TABLE bookings ADD COLUMN notify_12_sent BOOLEAN DEFAULT 0")
+
+
+async def epoch_booking_times(db: aiosqlite.Connection):
+    # Пересобираем таблицу одним INSERT ... SELECT: booking_at (ISO) -> start_ts/end_ts (unix epoch)
+    await db.execute("""
+        CREATE TABLE bookings_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            table_number TEXT NOT NULL,
+            time TEXT NOT NULL,
+            name TEXT NOT NULL,
+            start_ts INTEGER NOT NULL,
+            end_ts INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            notify_24_sent BOOLEAN DEFAULT 0,
+            notify_12_sent BOOLEAN DEFAULT 0
+        )
+        """)
+    await db.execute(f"""
+        INSERT INTO bookings_new (
+            id, user_id, table_number, time, name, start_ts, end_ts,
+            created_at, notify_24_sent, notify_12_sent
+        )
+        SELECT
+            id, user_id, table_number, time, name,
+            CAST(strftime('%s', booking_at) AS INTEGER),
+            CAST(strftime('%s', booking_at) AS INTEGER) + {BOOKING_DURATION_SECONDS},
+            created_at, notify_24_sent, notify_12_sent
+        FROM bookings
+        """)
+    await db.execute("DROP TABLE bookings")
+    await db.execute("ALTER TABLE bookings_new RENAME TO bookings")
+    await db.execute("CREATE INDEX idx_bookings_table_start ON bookings (table_number, start_ts)")
+    await db.execute("CREATE INDEX idx_bookings_user ON bookings (user_id)")
+    await db.execute("CREATE INDEX idx_bookings_start ON bookings (start_ts)")
+
+
+async def booking_guests(db: aiosqlite.Connection):
+    # Раньше в table_number писалось количество гостей: переносим его в guests
+    # и сажаем старые брони за наименьший подходящий стол
+    await db.execute("ALTER TABLE bookings ADD COLUMN guests INTEGER NOT NULL DEFAULT 0")
+    await db.execute("""
+        UPDATE bookings SET
+            guests = CAST(table_number AS INTEGER),
+            table_number = CASE
+                WHEN CAST(table_number AS INTEGER) <= 3 THEN 'T3_1'
+                WHEN CAST(table_number AS INTEGER) <= 6 THEN 'T6_1'
+                ELSE 'T8_1'
+            END
+        WHERE table_number <> '' AND table_number NOT GLOB '*[^0-9]*'
+        """)
+
+
+async def bookings_archive(db: aiosqlite.Connection):
+    # Завершённые и отменённые брони уезжают сюда, в bookings остаются только актуальные
+    await db.execute("""
+        CREATE TABLE bookings_archive (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            table_number TEXT NOT NULL,
+            guests INTEGER NOT NULL,
+            time TEXT NOT NULL,
+            name TEXT NOT NULL,
+            start_ts INTEGER NOT NULL,
+            end_ts INTEGER NOT NULL,
+            created_at TIMESTAMP,
+            status TEXT NOT NULL,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+    await db.execute("CREATE INDEX idx_archive_start ON bookings_archive (start_ts)")
+    await db.execute("CREATE INDEX idx_bookings_end ON bookings (end_ts)")
+
+
+async def outbox(db: aiosqlite.Connection):
+    # Очередь исходящих сообщений: пишется в той же транзакции, что и изменение брони
+    await db.execute("""
+        CREATE TABLE outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_ts INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+    await db.execute("CREATE INDEX idx_outbox_next ON outbox (next_attempt_ts)")
+
+
+async def slot_holds(db: aiosqlite.Connection):
+    # Короткая «бронь-черновик» стола, пока гость вводит имя и телефон; у гостя — не больше одной
+    await db.execute("""
+        CREATE TABLE slot_holds (
+            user_id INTEGER PRIMARY KEY,
+            table_number TEXT NOT NULL,
+            start_ts INTEGER NOT NULL,
+            end_ts INTEGER NOT NULL,
+            expires_at INTEGER NOT NULL
+        )
+        """)
+    await db.execute("CREATE INDEX idx_holds_table_start ON slot_holds (table_number, start_ts)")
+    await db.execute("CREATE INDEX idx_holds_expires ON slot_holds (expires_at)")
+
+
+async def fsm_state(db: aiosqlite.Connection):
+    # Состояние диалогов aiogram, чтобы перезапуск не сбрасывал недозаполненные брони
+    await db.execute("""
+        CREATE TABLE fsm_state (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL DEFAULT '{}',
+            updated_at INTEGER NOT NULL
+        )
+        """)
+    await db.execute("CREATE INDEX idx_fsm_updated ON fsm_state (updated_at)")
+
+
+async def leader_lease(db: aiosqlite.Connection):
+    # Аренда лидерства между экземплярами бота: token растёт при каждой смене владельца
+    await db.execute("""
+        CREATE TABLE leader_lease (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            token INTEGER NOT NULL,
+            expires_at REAL NOT NULL
+        )
+        """)
+
+
+async def sync_versions(db: aiosqlite.Connection):
+    # Счётчики изменений по областям данных: по ним экземпляры узнают о чужих записях
+    await db.execute("""
+        CREATE TABLE sync_versions (
+            name TEXT PRIMARY KEY,
+            seq INTEGER NOT NULL DEFAULT 0
+        )
+        """)
+    await db.executemany(
+        "INSERT INTO sync_versions (name) VALUES (?)",
+        [("bookings",), ("outbox",), ("fsm",)]
+    )
+
+
+async def booking_phone(db: aiosqlite.Connection):
+    # Телефон гостя раньше уходил только в сообщение менеджерам, теперь его показывает расписание дня
+    for table in ("bookings", "bookings_archive"):
+        await db.execute(f"ALTER TABLE {table} ADD COLUMN phone TEXT NOT NULL DEFAULT ''")
+
+
+async def dashboard_messages(db: aiosqlite.Connection):
+    # Закреплённое сообщение-расписание в чате менеджеров, по одному на день (дата в МСК)
+    await db.execute("""
+        CREATE TABLE dashboard_messages (
+            day TEXT PRIMARY KEY,
+            chat_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL
+        )
+        """)
+
+
+async def media_files(db: aiosqlite.Connection):
+    # file_id загруженных в Telegram картинок: ключ — sha256 содержимого, изменённый файл получит новый
+    await db.execute("""
+        CREATE TABLE media_files (
+            content_hash TEXT PRIMARY KEY,
+            file_id TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+
+
+async def waitlist(db: aiosqlite.Connection):
+    # Лист ожидания: у гостя одна заявка на день; offer_* — предложенный освободившийся стол
+    await db.execute("""
+        CREATE TABLE waitlist (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            first_slot INTEGER NOT NULL,
+            last_slot INTEGER NOT NULL,
+            guests INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            phone TEXT NOT NULL,
+            offer_table TEXT,
+            offer_start_ts INTEGER,
+            offer_expires_at INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (user_id, day)
+        )
+        """)
+    await db.execute("CREATE INDEX idx_waitlist_day ON waitlist (day)")
+    await db.execute("INSERT INTO sync_versions (name) VALUES ('waitlist')")
+
+
+async def outbox_reply_markup(db: aiosqlite.Connection):
+    # Кнопки к сообщению из outbox (JSON InlineKeyboardMarkup): так уходят и предложения листа ожидания
+    await db.execute("ALTER TABLE outbox ADD COLUMN reply_markup TEXT")
+
+
+async def slot_holds_waitlist(db: aiosqlite.Connection):
+    # Холды предложений из листа ожидания привязаны к заявке: у гостя может быть несколько
+    # предложений сразу и параллельно свой диалог бронирования. waitlist_id = 0 — холд диалога
+    await db.execute("""
+        CREATE TABLE slot_holds_new (
+            user_id INTEGER NOT NULL,
+            waitlist_id INTEGER NOT NULL DEFAULT 0,
+            table_number TEXT NOT NULL,
+            start_ts INTEGER NOT NULL,
+            end_ts INTEGER NOT NULL,
+            expires_at INTEGER NOT NULL,
+            PRIMARY KEY (user_id, waitlist_id)
+        )
+        """)
+    await db.execute("""
+        INSERT INTO slot_holds_new (user_id, table_number, start_ts, end_ts, expires_at)
+        SELECT user_id, table_number, start_ts, end_ts, expires_at FROM slot_holds
+        """)
+    await db.execute("DROP TABLE slot_holds")
+    await db.execute("ALTER TABLE slot_holds_new RENAME TO slot_holds")
+    await db.execute("CREATE INDEX idx_holds_table_start ON slot_holds (table_number, start_ts)")
+    await db.execute("CREATE INDEX idx_holds_expires ON slot_holds (expires_at)")
+
+
+
+async def drop_fsm_state(db: aiosqlite.Connection):
+    # Диалоги переехали в свою базу (FSM_MIGRATIONS): их запись больше не ждёт блокировку броней.
+    # Недозаполненные на момент обновления диалоги гости начнут заново
+    await db.execute("DROP TABLE fsm_state")
+
+
+# Порядок менять нельзя: номер миграции = индекс + 1, он хранится в PRAGMA user_version
+MIGRATIONS = [
+    create_bookings,
+    add_notification_flags,
+    epoch_booking_times,
+    booking_guests,
+    bookings_archive,
+    outbox,
+    slot_holds,
+    fsm_state,
+    leader_lease,
+    sync_versions,
+    booking_phone,
+    dashboard_messages,
+    media_files,
+    waitlist,
+    outbox_reply_markup,
+    slot_holds_waitlist,
+    drop_fsm_state,
+]
+
+# Отдельная база диалогов (db.FSM_DB_PATH), версия схемы у неё своя
+FSM_MIGRATIONS = [
+    fsm_state,
+]
+
+
+async def migrate(db: aiosqlite.Connection, migrations: list = MIGRATIONS):
+    """Применяет недостающие миграции внутри уже открытой транзакции."""
+    (version,) = await (await db.execute("PRAGMA user_version")).fetchone()
+    if version >= len(migrations):
+        return
+
+    for number, migration in enumerate(migrations[version:], start=version + 1):
+        logging.info("Миграция БД %s: %s", number, migration.__name__)
+        await migration(db)
+
+    # PRAGMA не поддерживает параметры, значение — наша константа
+    await db.execute(f"PRAGMA user_version = {len(migrations)}")
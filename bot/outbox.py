@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest, TelegramForbiddenError, TelegramNotFound, TelegramRetryAfter,
+)
+from aiogram.types import InlineKeyboardMarkup
+
+from db import (
+    subscribe, unsubscribe, claim_outbox, next_outbox_due, outbox_size,
+    delete_outbox_message, retry_outbox_message,
+)
+from metrics import collectors, outbox_depth
+from venues import venue, use_venue
+
+
+WORKERS_COUNT = 4
+BATCH_SIZE = 50
+LEASE_SECONDS = 300
+IDLE_POLL_SECONDS = 30
+MAX_ATTEMPTS = 8
+MAX_BACKOFF_SECONDS = 600
+
+# Лимиты Bot API: ~30 сообщений в секунду всего, 1 в секунду в личку, 20 в минуту в группу
+GLOBAL_INTERVAL = 1 / 30
+PRIVATE_CHAT_INTERVAL = 1.0
+GROUP_CHAT_INTERVAL = 3.0
+
+
+class RateLimiter:
+    """Равномерно разносит вызовы: не чаще одного раза в `interval` секунд."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._next = 0.0
+
+    @property
+    def idle(self) -> bool:
+        return self._next < time.monotonic()
+
+    def delay(self, until: float):
+        self._next = max(self._next, until)
+
+    async def wait(self):
+        now = time.monotonic()
+        slot = max(now, self._next)
+        self._next = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+# Лимиты считаются на бота, а не на заведение: outbox'ы всех заведений делят одни ограничители
+_global_limiter = RateLimiter(GLOBAL_INTERVAL)
+_chat_limiters: dict[int, RateLimiter] = {}
+_chat_locks: dict[int, asyncio.Lock] = {}
+
+
+class Outbox:
+    """Воркеры, которые вычитывают таблицу outbox и отправляют сообщения в пределах лимитов Telegram.
+
+    Читает outbox заведения, в контексте которого создан; на каждое заведение — свой экземпляр.
+    """
+
+    def __init__(self, bot: Bot, workers: int = WORKERS_COUNT):
+        self.bot = bot
+        self.workers_count = workers
+        self.venue_id = venue().id
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=BATCH_SIZE)
+        self._wakeup = asyncio.Event()
+        self._global = _global_limiter
+        self._chats = _chat_limiters
+        self._chat_locks = _chat_locks
+
+    def notify(self, _message=None):
+        self._wakeup.set()
+
+    def _on_external(self, area: str):
+        if area == "outbox":
+            self._wakeup.set()
+
+    def _chat_limiter(self, chat_id: int) -> RateLimiter:
+        limiter = self._chats.get(chat_id)
+        if limiter is None:
+            interval = GROUP_CHAT_INTERVAL if chat_id < 0 else PRIVATE_CHAT_INTERVAL
+            limiter = self._chats[chat_id] = RateLimiter(interval)
+        return limiter
+
+    def _forget_idle_chats(self):
+        for chat_id in [c for c, limiter in self._chats.items() if limiter.idle]:
+            lock = self._chat_locks.get(chat_id)
+            if lock is None or not lock.locked():
+                self._chats.pop(chat_id)
+                self._chat_locks.pop(chat_id, None)
+
+    async def _send(self, message_id: int, chat_id: int, text: str, reply_markup: str | None, attempts: int):
+        lock = self._chat_locks.setdefault(chat_id, asyncio.Lock())
+        try:
+            # Лок держит порядок сообщений в одном чате
+            async with lock:
+                await self._chat_limiter(chat_id).wait()
+                await self._global.wait()
+                await self.bot.send_message(
+                    chat_id, text,
+                    reply_markup=InlineKeyboardMarkup.model_validate_json(reply_markup) if reply_markup else None,
+                )
+        except TelegramRetryAfter as e:
+            logging.warning("Telegram просит подождать %s с перед отправкой в %s", e.retry_after, chat_id)
+            self._global.delay(time.monotonic() + e.retry_after)
+            await retry_outbox_message(message_id, int(time.time()) + e.retry_after, count_attempt=False)
+            self.notify()
+        except (TelegramForbiddenError, TelegramBadRequest, TelegramNotFound) as e:
+            # Повтор не поможет: бот заблокирован или сообщение некорректно
+            logging.warning("Сообщение %s в %s отброшено: %s", message_id, chat_id, e)
+            await delete_outbox_message(message_id)
+        except Exception:
+            if attempts + 1 >= MAX_ATTEMPTS:
+                logging.exception("Сообщение %s в %s отброшено после %s попыток", message_id, chat_id, attempts + 1)
+                await delete_outbox_message(message_id)
+            else:
+                logging.exception("Ошибка отправки сообщения %s в %s", message_id, chat_id)
+                backoff = min(MAX_BACKOFF_SECONDS, 2 ** attempts * 5)
+                await retry_outbox_message(message_id, int(time.time()) + backoff)
+                self.notify()
+        else:
+            await delete_outbox_message(message_id)
+
+    async def _worker(self):
+        while True:
+            message = await self._queue.get()
+            try:
+                await self._send(*message)
+            except Exception:
+                logging.exception("Ошибка в воркере outbox")
+            finally:
+                self._queue.task_done()
+
+    async def _feed(self):
+        while True:
+            try:
+                self._wakeup.clear()
+                batch = await claim_outbox(int(time.time()), self._queue.maxsize - self._queue.qsize(), LEASE_SECONDS)
+                for message in batch:
+                    await self._queue.put(message)
+                if len(batch) == BATCH_SIZE:
+                    continue
+
+                self._forget_idle_chats()
+                next_ts = await next_outbox_due()
+                timeout = IDLE_POLL_SECONDS
+                if next_ts is not None:
+                    timeout = min(timeout, max(1, next_ts - time.time()))
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            except Exception:
+                logging.exception("Ошибка при чтении outbox")
+                await asyncio.sleep(IDLE_POLL_SECONDS)
+
+    async def _collect_depth(self):
+        # Сборщики вызывает сервер метрик, вне контекста заведения
+        with use_venue(self.venue_id):
+            outbox_depth.set(await outbox_size(), venue=self.venue_id)
+
+    async def run(self):
+        subscribe("enqueued", self.notify)
+        subscribe("external", self._on_external)
+        collectors.append(self._collect_depth)
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.workers_count)]
+        try:
+            await self._feed()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            unsubscribe("enqueued", self.notify)
+            unsubscribe("external", self._on_external)
+            collectors.remove(self._collect_depth)
@@ -0,0 +1,163 @@
+import asyncio
+import heapq
+import logging
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Callable
+
+from metrics import reminder_lag
+from venues import venue
+from db import (
+    BookingRecord, Fence, subscribe, unsubscribe,
+    get_pending_reminders, get_reminders_by_ids, mark_reminders_sent,
+)
+
+
+# За сколько часов до брони напоминаем; порядок — от раннего к позднему
+REMINDER_HOURS = (24, 12)
+RETRY_DELAY = 60
+
+REMINDER_TEXTS = {
+    24: "⏰ Напоминание: у вас бронь стола — в {time}!\n"
+        "Для отмены введите /start и перейдите в 'мои брони'",
+    12: "⏰ Напоминание: у вас бронь стола через — в {time}!\n"
+        "Для отмены введите /start и перейдите в 'мои брони'",
+}
+
+
+class ReminderScheduler:
+    """Мин-куча дедлайнов напоминаний: спим ровно до ближайшего, а не опрашиваем базу раз в минуту."""
+
+    def __init__(self, fence: Callable[[], Fence | None] = lambda: None):
+        self.fence = fence
+        self._heap: list[tuple[int, int, int]] = []  # (due_ts, booking_id, hours)
+        # Отменённые брони, у которых ещё есть записи в куче; сколько записей у брони — в _queued
+        self._cancelled: set[int] = set()
+        self._queued: Counter[int] = Counter()
+        self._wakeup = asyncio.Event()
+        # Брони меняет и другой экземпляр бота: тогда кучу надо перечитать из базы
+        self._reload = False
+        self._local_changes = 0
+
+    def _push(self, due_ts: int, booking_id: int, hours: int):
+        entry = (due_ts, booking_id, hours)
+        heapq.heappush(self._heap, entry)
+        self._queued[booking_id] += 1
+        # Будим цикл, только если новый дедлайн стал ближайшим
+        if self._heap[0] == entry:
+            self._wakeup.set()
+
+    def schedule(self, booking: BookingRecord):
+        self._local_changes += 1
+        now = int(time.time())
+        for hours in REMINDER_HOURS:
+            due_ts = booking.start_ts - hours * 3600
+            if due_ts > now:
+                self._push(due_ts, booking.id, hours)
+
+    def cancel(self, booking: BookingRecord):
+        # Ленивое удаление: запись выкинется из кучи, когда до неё дойдёт очередь
+        self._local_changes += 1
+        if self._queued[booking.id]:
+            self._cancelled.add(booking.id)
+
+    def _on_external(self, area: str):
+        if area == "bookings":
+            self._reload = True
+            self._wakeup.set()
+
+    async def _read_heap(self) -> list[tuple[int, int, int]]:
+        # Если пока читали базу, в этом процессе поменялись брони, снимок мог их не застать — читаем заново
+        while True:
+            seen = self._local_changes
+            now = int(time.time())
+            heap = []
+            for booking_id, start_ts, created_ts, sent_24, sent_12 in await get_pending_reminders(now):
+                sent = {24: sent_24, 12: sent_12}
+                for hours in REMINDER_HOURS:
+                    due_ts = start_ts - hours * 3600
+                    # Пропущенные за время простоя дедлайны окажутся в прошлом и уйдут сразу;
+                    # напоминания, которые наступили раньше создания брони, не нужны
+                    if not sent[hours] and due_ts >= created_ts:
+                        heap.append((due_ts, booking_id, hours))
+            if seen == self._local_changes:
+                heapq.heapify(heap)
+                return heap
+
+    async def load(self):
+        subscribe("saved", self.schedule)
+        subscribe("removed", self.cancel)
+        subscribe("external", self._on_external)
+        self._heap = await self._read_heap()
+        self._queued = Counter(booking_id for _, booking_id, _ in self._heap)
+        self._cancelled.clear()
+        self._wakeup.set()
+
+    def _pop_due(self, now: int) -> dict[int, list[int]]:
+        due = defaultdict(list)
+        if self._heap and self._heap[0][0] <= now:
+            reminder_lag.set(time.time() - self._heap[0][0], venue=venue().id)
+        while self._heap and self._heap[0][0] <= now:
+            _, booking_id, hours = heapq.heappop(self._heap)
+            if booking_id not in self._cancelled:
+                due[booking_id].append(hours)
+            self._queued[booking_id] -= 1
+            if not self._queued[booking_id]:
+                # Последняя запись брони ушла из кучи — помнить об отмене больше незачем
+                del self._queued[booking_id]
+                self._cancelled.discard(booking_id)
+        return due
+
+    async def _fire(self, due: dict[int, list[int]]):
+        now = int(time.time())
+        sent = defaultdict(list)
+        messages = []
+
+        # Перечитываем брони одним запросом: отменённые и уже отправленные отсеются сами
+        for booking_id, user_id, start_ts, sent_24, sent_12 in await get_reminders_by_ids(due):
+            already_sent = {24: sent_24, 12: sent_12}
+            pending = [hours for hours in due[booking_id] if not already_sent[hours]]
+            if not pending or start_ts <= now:
+                continue
+
+            # После простоя могли накопиться оба напоминания — отправляем только самое позднее
+            text = REMINDER_TEXTS[min(pending)].format(time=datetime.fromtimestamp(start_ts, venue().tz).strftime("%H:%M"))
+            messages.append((user_id, text))
+            for hours in pending:
+                sent[hours].append(booking_id)
+
+        # Флаги и сообщения в outbox — одной транзакцией, отправкой займутся воркеры outbox
+        if sent:
+            await mark_reminders_sent(sent, messages, fence=self.fence())
+
+    async def run(self):
+        try:
+            await self._loop()
+        finally:
+            unsubscribe("saved", self.schedule)
+            unsubscribe("removed", self.cancel)
+            unsubscribe("external", self._on_external)
+
+    async def _loop(self):
+        while True:
+            try:
+                if self._reload:
+                    self._reload = False
+                    await self.load()
+                self._wakeup.clear()
+                timeout = None
+                if self._heap:
+                    timeout = max(0, self._heap[0][0] - time.time())
+                if timeout != 0:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+
+                due = self._pop_due(int(time.time()))
+                if due:
+                    await self._fire(due)
+            except Exception:
+                logging.exception("Ошибка в планировщике напоминаний")
+                await asyncio.sleep(RETRY_DELAY)
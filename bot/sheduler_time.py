@@ -1,36 +1,40 @@
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from datetime import datetime, timedelta, timezone
-from db import get_all_bookings, delete_booking_by_user_and_time
-from aiogram import Bot
+from datetime import datetime, timezone
+from typing import Callable
+from db import Fence, expire_bookings
+from metrics import expiry_batch
+from venues import venue, use_venue
 
 
-def setup_scheduler(bot: Bot):
+def thanks_text() -> str:
+    place = venue()
+    review = f"Поделиться впечатлениями можно здесь:\n{place.review_url}\n" if place.review_url else ""
+    return (
+        "✅ Спасибо, что выбрали нас!\n"
+        f"{review}"
+        f"Ждём вас снова в '{place.name_in}' 🌠\n\n"
+        f"📍 {place.address}"
+    )
+
+
+def thanks_messages(expired):
+    # Одному гостю с несколькими бронями хватит одного спасибо
+    text = thanks_text()
+    return [(user_id, text) for user_id in dict.fromkeys(booking.user_id for booking in expired)]
+
+
+def setup_scheduler(fence: Callable[[], Fence | None] = lambda: None) -> AsyncIOScheduler:
     scheduler = AsyncIOScheduler()
+    # Задачи планировщика не наследуют контекст вызывающего, заведение передаём явно
+    venue_id = venue().id
 
     async def remove_expired_bookings():
-        now = datetime.now(tz=timezone.utc)
-        bookings = await get_all_bookings()
-        for user_id, table, time, name, booking_at_str in bookings:
-            booking_at = datetime.fromisoformat(booking_at_str)
-            booking_at = datetime.fromisoformat(booking_at_str)
-            if booking_at.tzinfo is None:
-                booking_at = booking_at.replace(tzinfo=timezone.utc)
-            else:
-                booking_at = booking_at.astimezone(timezone.utc)
-
-            if now > booking_at + timedelta(hours=2):
-                await delete_booking_by_user_and_time(user_id, booking_at_str)
-                try:
-                    await bot.send_message(
-                        user_id,
-                        "✅ Спасибо, что выбрали нас!\n"
-                        "Поделиться впечатлениями можно здесь:\n"
-                        "https://yandex.ru/maps/org/meteorit/217545735013?si=7j55a8hmy7v26bxzkk2kqg7dbm\n"
-                        "Ждём вас снова в 'Метеорите' 🌠\n\n"
-                        "📍 ул. Покровка, 20/1с1"
-                    )
-                except Exception as e:
-                    print(f"Ошибка при отправке: {e}")
+        now = int(datetime.now(tz=timezone.utc).timestamp())
+        with use_venue(venue_id):
+            # Одна транзакция переносит все завершённые брони в архив и ставит благодарности в outbox
+            expired = await expire_bookings(now, compose_messages=thanks_messages, fence=fence())
+        expiry_batch.set(len(expired), venue=venue_id)
 
     scheduler.add_job(remove_expired_bookings, "interval", minutes=2)
     scheduler.start()
+    return scheduler
@@ -0,0 +1,50 @@
+from collections import OrderedDict
+
+from db import BookingRecord, get_booking, subscribe
+from venues import VenueLocal
+
+
+CACHE_SIZE = 10_000
+
+
+class UserBookingsCache:
+    """Активные брони гостя для «Мои брони»: LRU по user_id, сбрасывается событиями db.py.
+
+    Свои сохранения, отмены и архивация снимают запись конкретного гостя,
+    изменения с другого экземпляра бота — весь кэш.
+    """
+
+    def __init__(self, maxsize: int = CACHE_SIZE):
+        self.maxsize = maxsize
+        self._items: OrderedDict[int, list[BookingRecord]] = OrderedDict()
+        # Растёт при каждой инвалидации: ответ базы, прочитанный до неё, в кэш не кладём
+        self._generation = 0
+        subscribe("saved", self.invalidate)
+        subscribe("removed", self.invalidate)
+        subscribe("external", self._on_external)
+
+    def invalidate(self, booking: BookingRecord):
+        self._generation += 1
+        self._items.pop(booking.user_id, None)
+
+    def _on_external(self, area: str):
+        if area == "bookings":
+            self._generation += 1
+            self._items.clear()
+
+    async def get(self, user_id: int) -> list[BookingRecord]:
+        bookings = self._items.get(user_id)
+        if bookings is not None:
+            self._items.move_to_end(user_id)
+            return bookings
+
+        generation = self._generation
+        bookings = await get_booking(user_id)
+        if generation == self._generation:
+            self._items[user_id] = bookings
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return bookings
+
+
+user_bookings = VenueLocal(UserBookingsCache)
@@ -0,0 +1,144 @@
+import json
+import re
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from functools import cached_property
+from datetime import datetime, time, tzinfo
+from pathlib import Path
+from typing import Callable, Generic, TypeVar
+from zoneinfo import ZoneInfo
+
+
+VENUES_PATH = Path(__file__).parent / "venues.json"
+# id заведения попадает в callback data через "_", поэтому сам "_" в нём запрещён
+VENUE_ID = re.compile(r"^[a-z0-9-]+$")
+
+
+@dataclass(frozen=True)
+class Venue:
+    """Заведение: свои столы, часы, чат менеджеров, часовой пояс и свой файл базы."""
+    id: str
+    name: str
+    # Название в предложном падеже, для фраз вида «ждём вас в …»
+    name_in: str
+    address: str
+    db_path: Path
+    tables_path: Path
+    manager_chat_id: int
+    timezone: str = "Europe/Moscow"
+    # Первое и последнее время начала брони, которые предлагаются гостю
+    opens: time = time(9, 0)
+    last_start: time = time(23, 30)
+    # Последнее время, на которое бот сам подбирает стол: ближайшее свободное время и лист ожидания
+    last_seating: time = time(22, 30)
+    review_url: str = ""
+
+    @cached_property
+    def tz(self) -> tzinfo:
+        # Поиск в кэше ZoneInfo по имени тоже не бесплатен, а пояс нужен на каждую бронь
+        return ZoneInfo(self.timezone)
+
+    def now(self) -> datetime:
+        return datetime.now(self.tz)
+
+
+_venues: dict[str, Venue] = {}
+_default_id: str | None = None
+_current: ContextVar[str | None] = ContextVar("venue", default=None)
+
+
+def load_venues(path: Path | str = VENUES_PATH):
+    """Читает venues.json; относительные пути к базе и столам — от каталога файла."""
+    path = Path(path)
+    raw = json.loads(path.read_text(encoding="utf-8"))
+    venues = {}
+    for item in raw["venues"]:
+        if not VENUE_ID.match(item["id"]) or item["id"] in venues:
+            raise ValueError(f"Некорректный id заведения: {item['id']}")
+        venues[item["id"]] = Venue(
+            id=item["id"],
+            name=item["name"],
+            name_in=item.get("name_in", item["name"]),
+            address=item.get("address", ""),
+            db_path=path.parent / item["db_path"],
+            tables_path=path.parent / item["tables_path"],
+            manager_chat_id=int(item["manager_chat_id"]),
+            timezone=item.get("timezone", Venue.timezone),
+            opens=time.fromisoformat(item.get("opens", "09:00")),
+            last_start=time.fromisoformat(item.get("last_start", "23:30")),
+            last_seating=time.fromisoformat(item.get("last_seating", "22:30")),
+            review_url=item.get("review_url", ""),
+        )
+    if not venues:
+        raise ValueError("В venues.json нет ни одного заведения")
+    global _default_id
+    _venues.clear()
+    _venues.update(venues)
+    _default_id = next(iter(venues))
+
+
+def all_venues() -> list[Venue]:
+    if not _venues:
+        load_venues()
+    return list(_venues.values())
+
+
+def default_venue() -> Venue:
+    """Первое заведение из venues.json: в его базе живут и общие данные, например диалоги FSM."""
+    if _default_id is None:
+        load_venues()
+    return _venues[_default_id]
+
+
+def get_venue(venue_id: str) -> Venue | None:
+    all_venues()
+    return _venues.get(venue_id)
+
+
+def venue() -> Venue:
+    """Заведение, с которым работает текущая задача; вне use_venue() — заведение по умолчанию."""
+    venue_id = _current.get()
+    return _venues[venue_id] if venue_id is not None else default_venue()
+
+
+def venue_by_chat(chat_id: int) -> Venue | None:
+    return next((v for v in all_venues() if v.manager_chat_id == chat_id), None)
+
+
+@contextmanager
+def use_venue(venue_id: str):
+    """Всё, что выполняется внутри, включая созданные здесь задачи, относится к заведению venue_id."""
+    if get_venue(venue_id) is None:
+        raise KeyError(f"Неизвестное заведение: {venue_id}")
+    token = _current.set(venue_id)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+T = TypeVar("T")
+
+
+class VenueLocal(Generic[T]):
+    """Свой экземпляр объекта на каждое заведение; атрибуты берутся у экземпляра текущего.
+
+    Каждое обращение через прокси ищет заведение заново: в циклах по столам и броням
+    экземпляр нужно взять один раз через current().
+    """
+
+    def __init__(self, factory: Callable[[], T]):
+        self._factory = factory
+        self._instances: dict[str, T] = {}
+
+    def current(self) -> T:
+        venue_id = _current.get() or _default_id or default_venue().id
+        instance = self._instances.get(venue_id)
+        if instance is None:
+            # Создаётся внутри контекста заведения: подписки на события db.py попадут куда нужно
+            instance = self._instances[venue_id] = self._factory()
+        return instance
+
+    def __getattr__(self, name: str):
+        return getattr(self.current(), name)
@@ -0,0 +1,333 @@
+import asyncio
+import heapq
+import logging
+import time
+from datetime import date, datetime, timedelta
+from typing import Callable
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from db import (
+    HOLD_TTL, BookingRecord, Fence, WaitlistEntry, subscribe, unsubscribe,
+    hold_slot, release_hold, get_waitlist, set_waitlist_offer, delete_waitlist_entries,
+)
+from availability import (
+    BOOKING_SLOTS, DAY_MASK, SLOT_MINUTES, SLOTS_PER_DAY, UNIT_SEPARATOR, run_mask, slot_label, slot_of,
+    subscribe_freed, unsubscribe_freed,
+)
+from allocation import inventory, allocate, free_starts
+from metrics import waitlist_offers, waitlist_size
+from venues import venue
+
+
+# Столько у гостя есть на ответ; столько же держится холд на предложенный стол
+OFFER_TTL = timedelta(minutes=10)
+# Отмены, пришедшие почти одновременно, разбираются одним проходом
+DEBOUNCE_SECONDS = 0.5
+RETRY_DELAY = 30
+EXPIRED_TEXT = "⌛ Время на ответ вышло, стол предложен следующему гостю из листа ожидания."
+
+
+def seat_class(guests: int) -> int | None:
+    """Наименьшая вместимость стола, за который садится компания."""
+    fitting = inventory.fitting(guests)
+    return fitting[0].seats if fitting else None
+
+
+def window_mask(first_slot: int, last_slot: int) -> int:
+    return run_mask(last_slot + 1) >> first_slot << first_slot
+
+
+def overlapping_starts(slot: int) -> int:
+    """Начала броней, которые пересеклись бы с бронью, начинающейся в `slot`."""
+    return window_mask(max(0, slot - BOOKING_SLOTS + 1), min(SLOTS_PER_DAY - 1, slot + BOOKING_SLOTS - 1))
+
+
+def freed_starts(freed: int) -> tuple[int, int]:
+    """Начала броней (в этот день, в предыдущий день), которые задевают освободившиеся слоты `freed`."""
+    # Младшие SLOTS_PER_DAY бит — предыдущий день: поздняя бронь накануне заходит за полночь
+    wide, starts = freed << SLOTS_PER_DAY, 0
+    for shift in range(BOOKING_SLOTS):
+        starts |= wide >> shift
+    return starts >> SLOTS_PER_DAY & DAY_MASK, starts & DAY_MASK
+
+
+def offer_markup(entry_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="✅ Забронировать", callback_data=f"wl_accept_{entry_id}_{venue().id}"),
+        InlineKeyboardButton(text="❌ Отказаться", callback_data=f"wl_decline_{entry_id}_{venue().id}"),
+    ]])
+
+
+class WaitlistIndex:
+    """Заявки листа ожидания по (дате, классу стола) и получасам.
+
+    Для каждой пары (дата, класс) хранится 48 корзин: в корзине слота лежат заявки,
+    чьё окно времени его покрывает. Освободившийся интервал — это маска слотов, так что
+    подходящие заявки собираются из нескольких корзин, без обхода всего листа.
+    """
+
+    def __init__(self):
+        self._buckets: dict[tuple[date, int], list[dict[int, WaitlistEntry]]] = {}
+        self._entries: dict[int, WaitlistEntry] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _key(self, entry: WaitlistEntry) -> tuple[date, int | None]:
+        return date.fromisoformat(entry.day), seat_class(entry.guests)
+
+    def clear(self):
+        self._buckets.clear()
+        self._entries.clear()
+
+    def get(self, entry_id: int) -> WaitlistEntry | None:
+        return self._entries.get(entry_id)
+
+    def add(self, entry: WaitlistEntry):
+        self.remove(entry.id)
+        key = self._key(entry)
+        # Компанию, которой не подходит ни один стол, всё равно не посадить
+        if key[1] is None:
+            return
+        self._entries[entry.id] = entry
+        slots = self._buckets.setdefault(key, [{} for _ in range(SLOTS_PER_DAY)])
+        for slot in range(entry.first_slot, entry.last_slot + 1):
+            slots[slot][entry.id] = entry
+
+    def remove(self, entry_id: int):
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        key = self._key(entry)
+        slots = self._buckets[key]
+        for slot in range(entry.first_slot, entry.last_slot + 1):
+            slots[slot].pop(entry_id, None)
+        if not any(slots):
+            del self._buckets[key]
+
+    def days(self) -> set[date]:
+        return {day for day, _ in self._buckets}
+
+    def ids_before(self, day: date) -> list[int]:
+        return [
+            entry_id
+            for (bucket_day, _), slots in self._buckets.items() if bucket_day < day
+            for bucket in slots for entry_id in bucket
+        ]
+
+    def match(self, day: date, mask: int, max_seats: int) -> list[WaitlistEntry]:
+        """Заявки на `day`, чьё окно пересекает `mask` и кому хватит стола на `max_seats` мест, — в порядке очереди."""
+        found = {}
+        for seats in inventory.seat_classes:
+            if seats > max_seats:
+                break
+            slots = self._buckets.get((day, seats))
+            if slots is None:
+                continue
+            bits = mask
+            while bits:
+                low = bits & -bits
+                found.update(slots[low.bit_length() - 1])
+                bits ^= low
+        return sorted(found.values(), key=lambda entry: entry.id)
+
+
+class WaitlistMatcher:
+    """Раздаёт освободившиеся столы гостям из листа ожидания; работает только на лидере.
+
+    Отмена брони, снятая или истёкшая заявка с предложением помечают день и маску слотов
+    «грязными»; проход по ним находит подходящие заявки через WaitlistIndex, ставит
+    на стол холд на OFFER_TTL и ставит гостю предложение в outbox — в той же транзакции,
+    что и само предложение, так что до гостя оно дойдёт и после сетевых ошибок и
+    RetryAfter. Кто не ответил вовремя, выбывает из листа, и стол уходит следующему.
+    """
+
+    def __init__(self, fence: Callable[[], Fence | None] = lambda: None, debounce: float = DEBOUNCE_SECONDS):
+        self.fence = fence
+        self.debounce = debounce
+        self.index = WaitlistIndex()
+        # дата -> [маска слотов, наибольшая вместимость освободившегося стола]
+        self._dirty: dict[date, list[int]] = {}
+        # (срок, id заявки с предложением или 0, ISO-дата, маска) — истечение предложений и чужих холдов
+        self._timers: list[tuple[int, int, str, int]] = []
+        self._wakeup = asyncio.Event()
+        self._reload = True
+
+    def _mark(self, day: date, mask: int, max_seats: int | None = None):
+        dirty = self._dirty.setdefault(day, [0, 0])
+        dirty[0] |= mask
+        dirty[1] = max(dirty[1], max_seats or inventory.max_guests)
+        self._wakeup.set()
+
+    def _mark_all(self):
+        for day in self.index.days():
+            self._mark(day, DAY_MASK)
+
+    def _on_removed(self, booking: BookingRecord):
+        # Завершённая бронь ничего не освобождает: её время уже прошло
+        if booking.start_ts <= time.time():
+            return
+        start = datetime.fromtimestamp(booking.start_ts, venue().tz)
+        tables = set(booking.table_number.split(UNIT_SEPARATOR))
+        # Освободившийся стол мог открыть и сочетание столов побольше
+        max_seats = max((unit.seats for unit in inventory.units if tables & set(unit.tables)), default=None)
+        self._mark(start.date(), overlapping_starts(slot_of(start.hour, start.minute)), max_seats)
+
+    def _on_waitlisted(self, entry: WaitlistEntry):
+        self.index.add(entry)
+        waitlist_size.set(len(self.index), venue=venue().id)
+        # Пока гость вводил имя и телефон, в его окне могло что-то освободиться
+        self._mark(date.fromisoformat(entry.day), window_mask(entry.first_slot, entry.last_slot), seat_class(entry.guests))
+
+    def _on_unwaitlisted(self, entry: WaitlistEntry):
+        self.index.remove(entry.id)
+        waitlist_size.set(len(self.index), venue=venue().id)
+        if entry.offer_start_ts is not None:
+            # Отказ или истёкшее предложение: стол достаётся следующему
+            start = datetime.fromtimestamp(entry.offer_start_ts, venue().tz)
+            self._mark(start.date(), overlapping_starts(slot_of(start.hour, start.minute)))
+
+    def _on_external(self, area: str):
+        if area == "waitlist":
+            self._reload = True
+            self._wakeup.set()
+
+    def _on_freed(self, day: date, freed: int):
+        # Отмены на других экземплярах: availability перечитал занятость и сообщил, какие слоты освободились
+        today, previous = freed_starts(freed)
+        self._mark(day, today)
+        if previous:
+            self._mark(day - timedelta(days=1), previous)
+
+    def _schedule(self, due_ts: int, entry_id: int = 0, day: date | None = None, mask: int = 0):
+        heapq.heappush(self._timers, (due_ts, entry_id, day.isoformat() if day else "", mask))
+
+    async def _load(self, today: date):
+        self.index.clear()
+        self._timers = []
+        for entry in await get_waitlist(today.isoformat()):
+            self.index.add(entry)
+            if entry.offer_expires_at is not None:
+                self._schedule(entry.offer_expires_at, entry.id)
+        waitlist_size.set(len(self.index), venue=venue().id)
+        self._mark_all()
+        logging.info("Лист ожидания: %s заявок, ждут ответа на предложение %s", len(self.index), len(self._timers))
+
+    async def _fire_timers(self):
+        now = time.time()
+        expired = []
+        while self._timers and self._timers[0][0] <= now:
+            _, entry_id, day, mask = heapq.heappop(self._timers)
+            if not entry_id:
+                self._mark(date.fromisoformat(day), mask)
+                continue
+            entry = self.index.get(entry_id)
+            if entry is not None and entry.offer_expires_at is not None and entry.offer_expires_at <= now:
+                expired.append(entry)
+        if not expired:
+            return
+        # Снятие заявки само пометит её стол грязным через "unwaitlisted"; сообщат только тем,
+        # чью заявку сняли именно сейчас, а не гостю, который успел ответить
+        removed = await delete_waitlist_entries(
+            [entry.id for entry in expired], fence=self.fence(),
+            compose_messages=lambda entries: [(entry.user_id, EXPIRED_TEXT) for entry in entries],
+        )
+        waitlist_offers.inc(len(removed), result="expired")
+
+    async def _offer(self, entry: WaitlistEntry, day: date, first_slot: int):
+        taken = set()
+        while True:
+            unit, slot = allocate(day, entry.guests, first_slot, entry.last_slot, exclude=taken)
+            if unit is None:
+                if taken:
+                    # По индексу столы свободны, но их держат чужие холды — вернёмся, когда те истекут
+                    self._schedule(int(time.time() + HOLD_TTL.total_seconds()), day=day,
+                                   mask=window_mask(first_slot, entry.last_slot))
+                return
+            start_ts = int((datetime.combine(day, datetime.min.time(), venue().tz) + timedelta(minutes=SLOT_MINUTES * slot)).timestamp())
+            if await hold_slot(entry.user_id, unit.id, start_ts, conflicts=inventory.conflicts(unit.id),
+                               ttl=OFFER_TTL, waitlist_id=entry.id):
+                break
+            taken.add(unit.id)
+
+        expires_at = int(time.time() + OFFER_TTL.total_seconds())
+        text = (
+            f"🎉 Освободился стол на {day.strftime('%d.%m.%Y')} в {slot_label(slot)} "
+            f"для {entry.guests} гостей!\n"
+            f"Предложение действует {int(OFFER_TTL.total_seconds()) // 60} минут."
+        )
+        # Если сообщение так и не дойдёт (бот заблокирован), предложение просто истечёт и уйдёт следующему
+        markup = offer_markup(entry.id).model_dump_json(exclude_none=True)
+        offered = await set_waitlist_offer(
+            entry.id, unit.id, start_ts, expires_at, fence=self.fence(), messages=[(entry.user_id, text, markup)]
+        )
+        if offered is None:
+            # Гость успел снять заявку, пока ставили холд
+            await release_hold(entry.user_id, entry.id)
+            return
+        self.index.add(offered)
+        self._schedule(expires_at, offered.id)
+        waitlist_offers.inc(result="sent")
+
+    async def _fill(self, day: date, mask: int, max_seats: int, now: datetime):
+        first_allowed = slot_of(now.hour, now.minute) + 1 if day == now.date() else 0
+        for entry in self.index.match(day, mask, max_seats):
+            if entry.offer_expires_at is not None and entry.offer_expires_at > time.time():
+                continue
+            first_slot = max(entry.first_slot, first_allowed)
+            if first_slot > entry.last_slot:
+                continue
+            # Дешёвая проверка по маскам: большинство заявок отсеивается без обращения к базе
+            if not free_starts(day, entry.guests) & window_mask(first_slot, entry.last_slot):
+                continue
+            await self._offer(entry, day, first_slot)
+
+    async def flush(self):
+        now = venue().now()
+        if self._reload:
+            self._reload = False
+            await self._load(now.date())
+
+        stale = self.index.ids_before(now.date())
+        if stale:
+            await delete_waitlist_entries(stale, fence=self.fence())
+        await self._fire_timers()
+
+        dirty, self._dirty = self._dirty, {}
+        for day, (mask, max_seats) in sorted(dirty.items()):
+            if day < now.date():
+                continue
+            try:
+                await self._fill(day, mask, max_seats, now)
+            except Exception:
+                logging.exception("Ошибка при разборе листа ожидания на %s", day)
+                self._schedule(int(time.time()) + RETRY_DELAY, day=day, mask=mask)
+
+    async def run(self):
+        subscribe("removed", self._on_removed)
+        subscribe("waitlisted", self._on_waitlisted)
+        subscribe("unwaitlisted", self._on_unwaitlisted)
+        subscribe("external", self._on_external)
+        subscribe_freed(self._on_freed)
+        self._reload = True
+        self._wakeup.set()
+        try:
+            while True:
+                timeout = max(0.0, self._timers[0][0] - time.time()) if self._timers else None
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                try:
+                    await self.flush()
+                except Exception:
+                    logging.exception("Ошибка при разборе листа ожидания")
+                await asyncio.sleep(self.debounce)
+        finally:
+            unsubscribe("removed", self._on_removed)
+            unsubscribe("waitlisted", self._on_waitlisted)
+            unsubscribe("unwaitlisted", self._on_unwaitlisted)
+            unsubscribe("external", self._on_external)
+            unsubscribe_freed(self._on_freed)
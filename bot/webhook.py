@@ -0,0 +1,120 @@
+import asyncio
+import hmac
+import logging
+import signal
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiohttp import web
+
+from metrics import collectors, webhook_queue
+
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+# Сколько апдейтов может ждать обработки на каждый воркер, прежде чем приём начнёт тормозить
+QUEUE_PER_WORKER = 4
+DRAIN_TIMEOUT = 30
+
+
+class WebhookServer:
+    """Принимает апдейты от Telegram по HTTP и отдаёт их в Dispatcher через пул воркеров.
+
+    Ответ 200 уходит сразу после постановки апдейта в очередь, а обработка идёт
+    в `workers` фоновых задачах. Когда очередь заполнена, приём ждёт свободного
+    места — так Telegram сам притормаживает, а не плодит задачи без ограничений.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, path: str, secret: str, workers: int):
+        self.dp = dp
+        self.bot = bot
+        self.path = path
+        self.secret = secret
+        self.workers_count = workers
+        self._queue: asyncio.Queue[Update] = asyncio.Queue(maxsize=workers * QUEUE_PER_WORKER)
+        self._workers: list[asyncio.Task] = []
+        self._accepting = True
+
+    async def handle(self, request: web.Request) -> web.Response:
+        # Проверяется всегда: webhook без секрета конфиг не пропускает
+        token = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(token.encode(), self.secret.encode()):
+            return web.Response(status=401)
+        if not self._accepting:
+            # Telegram повторит апдейт позже — его подберёт следующий запуск
+            return web.Response(status=503)
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except ValueError:
+            logging.warning("Некорректный апдейт в webhook")
+            return web.Response(status=400)
+        await self._queue.put(update)
+        return web.Response()
+
+    async def _worker(self):
+        while True:
+            update = await self._queue.get()
+            try:
+                await self.dp.feed_update(self.bot, update)
+            except Exception:
+                logging.exception("Ошибка при обработке апдейта %s", update.update_id)
+            finally:
+                self._queue.task_done()
+
+    async def _collect_depth(self):
+        webhook_queue.set(self._queue.qsize())
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        return app
+
+    def start_workers(self):
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.workers_count)]
+        collectors.append(self._collect_depth)
+
+    async def drain(self, timeout: float = DRAIN_TIMEOUT):
+        """Перестаёт принимать апдейты и дожидается обработки уже принятых."""
+        self._accepting = False
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning("Не дождались обработки %s апдейтов", self._queue.qsize())
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        collectors.remove(self._collect_depth)
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, config):
+    secret = config.webhook_secret.get_secret_value()
+    server = WebhookServer(dp, bot, config.webhook_path, secret, config.webhook_workers)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    server.start_workers()
+    runner = web.AppRunner(server.app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, config.webhook_host, config.webhook_port).start()
+    logging.info("Webhook слушает http://%s:%s%s", config.webhook_host, config.webhook_port, config.webhook_path)
+
+    # Без публичного адреса сервер годится для локального прогона записанных апдейтов
+    if config.webhook_url:
+        await bot.set_webhook(
+            config.webhook_url.rstrip("/") + config.webhook_path,
+            secret_token=secret,
+            allowed_updates=dp.resolve_used_update_types(),
+            max_connections=min(config.webhook_workers, 100),
+        )
+
+    try:
+        await stop.wait()
+    finally:
+        logging.info("Останавливаем webhook")
+        await server.drain()
+        await runner.cleanup()
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        await bot.session.close()